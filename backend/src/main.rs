@@ -1,14 +1,32 @@
 use axum::{
+    body::Bytes,
     extract::{Json as AxumJson, Path, Query},
-    response::{Html, Json, Redirect},
+    http::{header, HeaderMap, StatusCode},
+    response::{Html, IntoResponse, Json, Redirect, Response},
     routing::{get, post},
     Extension, Router,
 };
+use dashmap::DashMap;
 use serde::{Deserialize, Serialize};
+use std::collections::hash_map::DefaultHasher;
+use std::future::Future;
+use std::hash::{Hash, Hasher};
 use std::net::SocketAddr;
 use std::sync::{Arc, Mutex};
+use std::time::{Duration, Instant};
 use uuid::Uuid;
 
+// How long a proxied response is served from the cache before GroupMe is
+// asked again. Message pages go stale fastest; the user profile barely moves.
+const GROUPS_TTL: Duration = Duration::from_secs(10);
+const MESSAGES_TTL: Duration = Duration::from_secs(2);
+const USER_TTL: Duration = Duration::from_secs(300);
+// Past this many entries, expired ones are swept on the next insert.
+const CACHE_SWEEP_THRESHOLD: usize = 512;
+// Hard cap: while the cache is this full even after a sweep, fresh responses
+// are served without being stored.
+const CACHE_MAX_ENTRIES: usize = 2048;
+
 // This struct matches the top-level API response object for groups from GroupMe.
 #[derive(Deserialize, Debug, Serialize)]
 struct ApiResponseGroups {
@@ -35,6 +53,129 @@ struct ApiResponseUser {
 #[derive(Clone)]
 struct AppState {
     access_token: Arc<Mutex<Option<String>>>,
+    // One pooled client so GroupMe connections are reused across requests.
+    http: reqwest::Client,
+    // Serialized responses keyed by (token, resource).
+    cache: Arc<DashMap<(String, String), CachedResponse>>,
+}
+
+#[derive(Clone)]
+struct CachedResponse {
+    etag: String,
+    body: Bytes,
+    fetched_at: Instant,
+    ttl: Duration,
+}
+
+impl CachedResponse {
+    fn is_fresh(&self) -> bool {
+        self.fetched_at.elapsed() < self.ttl
+    }
+}
+
+// The ETag is a hash of the serialized body, so a refetch that returns the
+// same data keeps the same tag and the client still gets a 304.
+fn etag_for(body: &[u8]) -> String {
+    let mut hasher = DefaultHasher::new();
+    body.hash(&mut hasher);
+    format!("\"{:016x}\"", hasher.finish())
+}
+
+fn etag_matches(headers: &HeaderMap, etag: &str) -> bool {
+    headers
+        .get(header::IF_NONE_MATCH)
+        .and_then(|value| value.to_str().ok())
+        .is_some_and(|value| {
+            value
+                .split(',')
+                .any(|tag| tag.trim() == etag || tag.trim() == "*")
+        })
+}
+
+// A request sent with `Cache-Control: no-cache` must not be answered from
+// the cache (the frontend uses it when it knows the data just changed).
+fn bypass_cache(headers: &HeaderMap) -> bool {
+    headers
+        .get(header::CACHE_CONTROL)
+        .and_then(|value| value.to_str().ok())
+        .is_some_and(|value| value.contains("no-cache"))
+}
+
+// Serves `resource` from the cache while it is fresh and fetches it
+// otherwise. Either way the response carries an ETag, and it is an empty 304
+// when the client's If-None-Match still matches.
+async fn cached_json<T, F, Fut>(
+    state: &AppState,
+    token: &str,
+    resource: String,
+    ttl: Duration,
+    headers: &HeaderMap,
+    fetch: F,
+) -> Result<Response, Box<dyn std::error::Error>>
+where
+    T: Serialize,
+    F: FnOnce() -> Fut,
+    Fut: Future<Output = Result<T, Box<dyn std::error::Error>>>,
+{
+    let key = (token.to_string(), resource);
+    let hit = if bypass_cache(headers) {
+        None
+    } else {
+        state
+            .cache
+            .get(&key)
+            .filter(|cached| cached.is_fresh())
+            .map(|cached| cached.clone())
+    };
+    let cached = match hit {
+        Some(cached) => cached,
+        None => {
+            let body = Bytes::from(serde_json::to_vec(&fetch().await?)?);
+            let cached = CachedResponse {
+                etag: etag_for(&body),
+                body,
+                fetched_at: Instant::now(),
+                ttl,
+            };
+            // Each entry expires by its own TTL, so the short-lived message
+            // pages every poll creates are the first to go
+            if state.cache.len() >= CACHE_SWEEP_THRESHOLD {
+                state.cache.retain(|_, entry| entry.is_fresh());
+            }
+            if state.cache.len() < CACHE_MAX_ENTRIES {
+                state.cache.insert(key, cached.clone());
+            }
+            cached
+        }
+    };
+
+    if etag_matches(headers, &cached.etag) {
+        return Ok((StatusCode::NOT_MODIFIED, [(header::ETAG, cached.etag)]).into_response());
+    }
+    Ok((
+        [
+            (header::CONTENT_TYPE, "application/json".to_string()),
+            (header::ETAG, cached.etag),
+        ],
+        cached.body,
+    )
+        .into_response())
+}
+
+// Drops every cached page of `group_id`'s messages for `token`, so the next
+// fetch after a send sees the new message.
+fn invalidate_messages(state: &AppState, token: &str, group_id: &str) {
+    let prefix = format!("groups/{group_id}/messages");
+    state.cache.retain(|(cached_token, resource), _| {
+        cached_token != token || !resource.starts_with(&prefix)
+    });
+}
+
+#[derive(Deserialize)]
+struct MessagesQuery {
+    since_id: Option<String>,
+    before_id: Option<String>,
+    limit: Option<u32>,
 }
 
 #[derive(Deserialize)]
@@ -108,6 +249,10 @@ struct Message {
     attachments: Option<Vec<Attachment>>,
     #[serde(default)]
     favorited_by: Vec<String>,
+    // Set by whoever posted the message; the frontend matches echoes of its
+    // own sends on it.
+    #[serde(default)]
+    source_guid: Option<String>,
 }
 
 #[derive(Deserialize, Debug, Serialize, Clone)]
@@ -115,11 +260,20 @@ struct Attachment {
     #[serde(rename = "type")]
     attachment_type: String,
     url: Option<String>,
+    // Only on "mentions" attachments: who is mentioned, and where in the
+    // text as [start, length] pairs.
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    user_ids: Option<Vec<String>>,
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    loci: Option<Vec<Vec<i64>>>,
 }
 
 #[derive(Deserialize, Debug, Serialize)]
 struct SendMessagePayload {
     text: String,
+    // Generated by the frontend so retries and echoes can be matched up; one
+    // is made here for clients that do not send it.
+    source_guid: Option<String>,
 }
 
 #[derive(Deserialize, Debug, Serialize, Clone)]
@@ -136,9 +290,11 @@ struct User {
 }
 
 // The main function to fetch groups from the GroupMe API.
-async fn get_groups_from_api(token: &str) -> Result<Vec<Group>, Box<dyn std::error::Error>> {
+async fn get_groups_from_api(
+    client: &reqwest::Client,
+    token: &str,
+) -> Result<Vec<Group>, Box<dyn std::error::Error>> {
     let mut all_groups = Vec::new();
-    let client = reqwest::Client::new();
     let mut page = 1;
     loop {
         let url = format!("https://api.groupme.com/v3/groups?page={page}&per_page=100");
@@ -164,19 +320,34 @@ async fn get_groups_from_api(token: &str) -> Result<Vec<Group>, Box<dyn std::err
     Ok(all_groups)
 }
 
-// Function to fetch messages for a specific group.
+// Function to fetch messages for a specific group. With `since_id`, only
+// messages newer than that id are returned; with `before_id`, the page of
+// messages just older than it. GroupMe caps `limit` at 100.
 async fn get_messages_from_api(
+    client: &reqwest::Client,
     group_id: &str,
     token: &str,
+    query: &MessagesQuery,
 ) -> Result<Vec<Message>, Box<dyn std::error::Error>> {
-    let url = format!("https://api.groupme.com/v3/groups/{group_id}/messages?limit=20");
-    let client = reqwest::Client::new();
+    let limit = query.limit.unwrap_or(20).clamp(1, 100);
+    let mut url = format!("https://api.groupme.com/v3/groups/{group_id}/messages?limit={limit}");
+    if let Some(since_id) = &query.since_id {
+        url.push_str(&format!("&since_id={since_id}"));
+    }
+    if let Some(before_id) = &query.before_id {
+        url.push_str(&format!("&before_id={before_id}"));
+    }
     let response = client
         .get(&url)
         .header("X-Access-Token", token)
         .send()
         .await?;
 
+    // GroupMe answers 304 with an empty body when there is nothing newer.
+    if response.status() == reqwest::StatusCode::NOT_MODIFIED {
+        return Ok(Vec::new());
+    }
+
     if !response.status().is_success() {
         let status = response.status();
         let error_text = response.text().await?;
@@ -189,16 +360,17 @@ async fn get_messages_from_api(
 
 // Function to send a message to a specific group.
 async fn send_message_to_api(
+    client: &reqwest::Client,
     group_id: &str,
     token: &str,
     text: String,
+    source_guid: Option<String>,
 ) -> Result<Message, Box<dyn std::error::Error>> {
     let url = format!("https://api.groupme.com/v3/groups/{group_id}/messages");
-    let client = reqwest::Client::new();
-    let unique_id = Uuid::new_v4().to_string();
+    let source_guid = source_guid.unwrap_or_else(|| Uuid::new_v4().to_string());
     let payload = serde_json::json!({
         "message": {
-            "source_guid": unique_id,
+            "source_guid": source_guid,
             "text": text,
         }
     });
@@ -227,9 +399,11 @@ async fn send_message_to_api(
 }
 
 // Function to get the current user's details.
-async fn get_current_user_from_api(token: &str) -> Result<User, Box<dyn std::error::Error>> {
+async fn get_current_user_from_api(
+    client: &reqwest::Client,
+    token: &str,
+) -> Result<User, Box<dyn std::error::Error>> {
     let url = "https://api.groupme.com/v3/users/me";
-    let client = reqwest::Client::new();
     let response = client
         .get(url)
         .header("X-Access-Token", token)
@@ -247,94 +421,144 @@ async fn get_current_user_from_api(token: &str) -> Result<User, Box<dyn std::err
 }
 
 // Axum handler to get all groups.
-async fn get_all_groups(Extension(state): Extension<Arc<AppState>>) -> Json<Vec<Group>> {
+async fn get_all_groups(
+    headers: HeaderMap,
+    Extension(state): Extension<Arc<AppState>>,
+) -> Response {
     let token = state.access_token.lock().unwrap().clone();
     if let Some(token) = token {
-        match get_groups_from_api(&token).await {
-            Ok(groups) => Json(groups),
+        let fetch = || get_groups_from_api(&state.http, &token);
+        match cached_json(
+            &state,
+            &token,
+            "groups".to_string(),
+            GROUPS_TTL,
+            &headers,
+            fetch,
+        )
+        .await
+        {
+            Ok(response) => response,
             Err(e) => {
                 eprintln!("Error fetching groups: {e}");
-                Json(vec![] as Vec<Group>)
+                Json(vec![] as Vec<Group>).into_response()
             }
         }
     } else {
-        Json(vec![] as Vec<Group>)
+        Json(vec![] as Vec<Group>).into_response()
     }
 }
 
 // Axum handler to get messages for a specific group.
 async fn get_group_messages(
     Path(group_id): Path<String>,
+    Query(query): Query<MessagesQuery>,
+    headers: HeaderMap,
     Extension(state): Extension<Arc<AppState>>,
-) -> Json<Vec<Message>> {
+) -> Response {
     let token = state.access_token.lock().unwrap().clone();
     if let Some(token) = token {
-        match get_messages_from_api(&group_id, &token).await {
-            Ok(messages) => Json(messages),
+        let resource = format!(
+            "groups/{group_id}/messages?since_id={}&before_id={}&limit={}",
+            query.since_id.as_deref().unwrap_or_default(),
+            query.before_id.as_deref().unwrap_or_default(),
+            query.limit.unwrap_or_default(),
+        );
+        let fetch = || get_messages_from_api(&state.http, &group_id, &token, &query);
+        match cached_json(&state, &token, resource, MESSAGES_TTL, &headers, fetch).await {
+            Ok(response) => response,
             Err(e) => {
                 eprintln!("Error fetching messages for group {group_id}: {e}");
-                Json(vec![] as Vec<Message>)
+                Json(vec![] as Vec<Message>).into_response()
             }
         }
     } else {
-        Json(vec![] as Vec<Message>)
+        Json(vec![] as Vec<Message>).into_response()
     }
 }
 
-// Axum handler to send a message to a specific group.
+// Axum handler to send a message to a specific group. Answers with the
+// posted message, or an error status the frontend's outbox can retry on.
 async fn send_group_message(
     Path(group_id): Path<String>,
     Extension(state): Extension<Arc<AppState>>,
     AxumJson(payload): AxumJson<SendMessagePayload>,
-) -> Json<String> {
+) -> Response {
     let token = state.access_token.lock().unwrap().clone();
     if let Some(token) = token {
-        match send_message_to_api(&group_id, &token, payload.text).await {
-            Ok(_) => Json("Message sent successfully".to_string()),
+        let sent = send_message_to_api(
+            &state.http,
+            &group_id,
+            &token,
+            payload.text,
+            payload.source_guid,
+        )
+        .await;
+        match sent {
+            Ok(message) => {
+                invalidate_messages(&state, &token, &group_id);
+                Json(message).into_response()
+            }
             Err(e) => {
                 eprintln!("Error sending message to group {group_id}: {e}");
-                Json(format!("Error sending message: {e}"))
+                (
+                    StatusCode::BAD_GATEWAY,
+                    Json(format!("Error sending message: {e}")),
+                )
+                    .into_response()
             }
         }
     } else {
-        Json("Not authenticated".to_string())
+        (
+            StatusCode::UNAUTHORIZED,
+            Json("Not authenticated".to_string()),
+        )
+            .into_response()
+    }
+}
+
+// Returned in place of the current user when there is no token or the
+// request fails.
+fn unknown_user() -> User {
+    User {
+        id: String::new(),
+        name: "Unknown User".to_string(),
+        email: String::new(),
+        image_url: String::new(),
+        phone_number: String::new(),
+        created_at: 0,
+        updated_at: 0,
+        locale: String::new(),
+        sms: false, // Corrected from sms_mode
     }
 }
 
 // Axum handler to get the current user's details.
-async fn get_current_user(Extension(state): Extension<Arc<AppState>>) -> Json<User> {
+async fn get_current_user(
+    headers: HeaderMap,
+    Extension(state): Extension<Arc<AppState>>,
+) -> Response {
     let token = state.access_token.lock().unwrap().clone();
     if let Some(token) = token {
-        match get_current_user_from_api(&token).await {
-            Ok(user) => Json(user),
+        let fetch = || get_current_user_from_api(&state.http, &token);
+        match cached_json(
+            &state,
+            &token,
+            "user/me".to_string(),
+            USER_TTL,
+            &headers,
+            fetch,
+        )
+        .await
+        {
+            Ok(response) => response,
             Err(e) => {
                 eprintln!("Error fetching current user: {e}");
-                // Return a default or empty User struct in case of error
-                Json(User {
-                    id: String::new(),
-                    name: "Unknown User".to_string(),
-                    email: String::new(),
-                    image_url: String::new(),
-                    phone_number: String::new(),
-                    created_at: 0,
-                    updated_at: 0,
-                    locale: String::new(),
-                    sms: false, // Corrected from sms_mode
-                })
+                Json(unknown_user()).into_response()
             }
         }
     } else {
-        Json(User {
-            id: String::new(),
-            name: "Unknown User".to_string(),
-            email: String::new(),
-            image_url: String::new(),
-            phone_number: String::new(),
-            created_at: 0,
-            updated_at: 0,
-            locale: String::new(),
-            sms: false, // Corrected from sms_mode
-        })
+        Json(unknown_user()).into_response()
     }
 }
 
@@ -352,6 +576,8 @@ async fn get_token(Extension(state): Extension<Arc<AppState>>) -> Json<TokenResp
 async fn main() {
     let state = Arc::new(AppState {
         access_token: Arc::new(Mutex::new(None)),
+        http: reqwest::Client::new(),
+        cache: Arc::new(DashMap::new()),
     });
 
     let app = Router::new()
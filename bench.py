@@ -0,0 +1,405 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+# Headless benchmark for the Tkinter client. It serves synthetic GroupMe data
+# from a local stand-in for the backend (and for the image host and the push
+# server), drives HexChatUI against it on a hidden Tk root and writes the
+# timings as JSON so runs can be compared. Needs a display; on a server run it
+# under Xvfb, e.g. `xvfb-run python bench.py --output results.json`.
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua ut enim ad minim"
+).split()
+IMAGE_VARIANTS = 16  # Distinct images on the fake host; URLs repeat like in chats
+
+
+class Fixtures:
+    # Deterministic synthetic groups, members and messages. Message ids are
+    # numeric strings that grow with created_at, as GroupMe's do.
+    def __init__(
+        self,
+        image_base,
+        groups=20,
+        members=50,
+        messages=500,
+        like_density=0.2,
+        image_density=0.1,
+        seed=0,
+    ):
+        self.random = random.Random(seed)
+        self.image_base = image_base
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.clock = 1_700_000_000
+        self.like_density = like_density
+        self.image_density = image_density
+        self.user = {
+            "id": "1",
+            "name": "Bench User",
+            "email": "bench@example.com",
+            "image_url": "",
+            "phone_number": "",
+            "created_at": self.clock,
+            "updated_at": self.clock,
+            "locale": "en",
+            "sms": False,
+        }
+        self.groups = [self._group(index, members) for index in range(groups)]
+        self.messages = {group["id"]: [] for group in self.groups}
+        for group in self.groups:
+            for _ in range(messages):
+                self.add_message(group["id"])
+
+    def _group(self, index, members):
+        group_id = str(1000 + index)
+        user_ids = ["1"] + [str(100_000 + index * members + n) for n in range(members)]
+        return {
+            "id": group_id,
+            "name": f"bench-{index}",
+            "type": "private",
+            "description": f"Benchmark group {index}",
+            "image_url": None,
+            "creator_user_id": "1",
+            "created_at": self.clock,
+            "updated_at": self.clock,
+            "members": [
+                {
+                    "user_id": user_id,
+                    "nickname": f"member-{user_id}",
+                    "image_url": None,
+                    "id": user_id,
+                    "muted": False,
+                    "autokicked": False,
+                    "roles": ["user"],
+                    "name": f"Member {user_id}",
+                }
+                for user_id in user_ids
+            ],
+        }
+
+    def add_message(self, group_id):
+        group = next(group for group in self.groups if group["id"] == group_id)
+        members = group["members"]
+        sender = self.random.choice(members)
+        words = self.random.choices(WORDS, k=self.random.randint(3, 30))
+        if self.random.random() < 0.1:
+            words.append(f"https://example.com/{self.random.randint(0, 999)}")
+        attachments = []
+        if self.random.random() < self.image_density:
+            variant = self.random.randrange(IMAGE_VARIANTS)
+            attachments.append(
+                {"type": "image", "url": f"{self.image_base}/images/{variant}.png"}
+            )
+        favorited_by = []
+        if self.random.random() < self.like_density:
+            likers = self.random.sample(members, min(len(members), 5))
+            favorited_by = [member["user_id"] for member in likers]
+        with self.lock:
+            message_id = str(self.next_id)
+            self.next_id += 1
+            self.clock += self.random.randint(1, 120)
+            message = {
+                "id": message_id,
+                "group_id": group_id,
+                "name": sender["nickname"],
+                "avatar_url": None,
+                "text": "" if attachments else " ".join(words),
+                "sender_id": sender["user_id"],
+                "sender_type": "user",
+                "created_at": self.clock,
+                "system": False,
+                "attachments": attachments,
+                "favorited_by": favorited_by,
+            }
+            self.messages[group_id].append(message)
+        return message
+
+    def page(self, group_id, since_id=None, before_id=None, limit=20):
+        # Newest first, like GroupMe
+        with self.lock:
+            messages = self.messages.get(group_id, [])
+            if since_id:
+                messages = [m for m in messages if int(m["id"]) > int(since_id)]
+            if before_id:
+                messages = [m for m in messages if int(m["id"]) < int(before_id)]
+            return list(reversed(messages[-limit:]))
+
+
+def render_images():
+    images = {}
+    for variant in range(IMAGE_VARIANTS):
+        size = (200 + variant * 40, 150 + variant * 30)
+        color = (variant * 15 % 256, 80, 255 - variant * 15 % 256)
+        buffer = io.BytesIO()
+        Image.new("RGB", size, color).save(buffer, format="PNG")
+        images[f"/images/{variant}.png"] = buffer.getvalue()
+    return images
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Serves the backend routes the client uses, the fake image host and a
+    # push server that turns clients away, so nothing leaves the machine
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        fixtures = self.server.fixtures
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if url.path == "/token":
+            self.send_json({"token": "bench-token"})
+        elif url.path == "/user/me":
+            self.send_json(fixtures.user)
+        elif url.path == "/groups":
+            self.send_json(fixtures.groups)
+        elif len(parts) == 3 and parts[0] == "groups" and parts[2] == "messages":
+            limit = max(1, min(100, int(query.get("limit", 20))))
+            self.send_json(
+                fixtures.page(
+                    parts[1], query.get("since_id"), query.get("before_id"), limit
+                )
+            )
+        elif url.path in self.server.images:
+            self.send_body(self.server.images[url.path], "image/png")
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/faye":
+            # Handshake refused with reconnect=none: the push client stops
+            # and the app falls back to polling, as it would offline
+            self.send_json(
+                [
+                    {
+                        "channel": "/meta/handshake",
+                        "successful": False,
+                        "advice": {"reconnect": "none"},
+                    }
+                ]
+            )
+        else:
+            self.send_error(404)
+
+    def send_json(self, data):
+        # Tagged like the real backend, so unchanged polls come back as 304
+        body = json.dumps(data).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_body(body, "application/json", etag)
+
+    def send_body(self, body, content_type, etag=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmark output clean
+
+
+def start_stub_server(**fixture_options):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    # Image URLs in the fixtures point back at this server
+    server.fixtures = Fixtures(
+        f"http://127.0.0.1:{server.server_port}", **fixture_options
+    )
+    server.images = render_images()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def pump(root, condition, timeout=30):
+    # Run the Tk event loop until condition() holds
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("benchmark step did not finish in time")
+        root.update()
+        time.sleep(0.001)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        "count": len(samples),
+        "min_ms": round(samples[0] * 1000, 3),
+        "median_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(
+            samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3
+        ),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # Bytes on macOS
+
+
+def run(args):
+    server = start_stub_server(
+        groups=args.groups,
+        members=args.members,
+        messages=args.messages,
+        like_density=args.like_density,
+        image_density=args.image_density,
+        seed=args.seed,
+    )
+    fixtures = server.fixtures
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    # main reads its endpoints and cache directory at import time
+    os.environ["GXCHAT_BACKEND_URL"] = base_url
+    os.environ["GXCHAT_PUSH_URL"] = f"{base_url}/faye"
+    os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="gxchat-bench-")
+    import tkinter as tk
+
+    import main as gxchat
+
+    root = tk.Tk()
+    root.geometry("800x600")
+    if not args.show:
+        root.withdraw()
+
+    results = {}
+    start = time.perf_counter()
+    app = gxchat.HexChatUI(master=root)
+    first_group = fixtures.groups[0]["id"]
+    pump(root, lambda: app.channel_list.size() > 0)
+    results["startup_to_channel_list_ms"] = round(
+        (time.perf_counter() - start) * 1000, 3
+    )
+    pump(
+        root,
+        lambda: app.current_group_id == first_group
+        and app.history_index.rendered_count() > 0,
+    )
+    results["startup_to_first_paint_ms"] = round(
+        (time.perf_counter() - start) * 1000, 3
+    )
+
+    def settled(group_id):
+        return (
+            app.current_group_id == group_id
+            and app.history_index.rendered_count() > 0
+            and not app.backend.tagged.get("channel")
+        )
+
+    # Channel switches, cold (nothing on disk yet) then warm (store and roster)
+    for label in ("cold", "warm"):
+        switches, images = [], []
+        for index in range(min(args.switches, len(fixtures.groups))):
+            group_id = fixtures.groups[index]["id"]
+            start = time.perf_counter()
+            app.select_channel(group_id)
+            pump(root, lambda: settled(group_id))
+            switches.append(time.perf_counter() - start)
+            pump(root, lambda: not app.image_marks)
+            images.append(time.perf_counter() - start)
+        results[f"channel_switch_{label}"] = summarize(switches)
+        results[f"channel_switch_{label}_images_settled"] = summarize(images)
+
+    # Poll cycles: one new message arrives upstream before each poll
+    app.stop_polling()  # Drive polls by hand instead of on the timer
+    app.is_polling = True
+    polls = []
+    for _ in range(args.polls):
+        message = fixtures.add_message(app.current_group_id)
+        start = time.perf_counter()
+        app.poll_messages()
+        app.after_cancel(app.polling_job)
+        app.polling_job = None
+        pump(root, lambda: app.history_index.newest_id() == message["id"])
+        polls.append(time.perf_counter() - start)
+    app.is_polling = False
+    results["poll_cycle"] = summarize(polls)
+
+    # Rendering N messages straight from the model, without the network
+    history = list(reversed(fixtures.page(app.current_group_id, limit=10**9)))
+    render = {}
+    for count in args.render_sizes:
+        samples = []
+        for _ in range(args.render_repeats):
+            app.clear_chat_history()
+            root.update()
+            start = time.perf_counter()
+            with app.chat_transaction(follow=True):
+                app.reconcile_messages(history[-count:])
+            root.update_idletasks()
+            samples.append(time.perf_counter() - start)
+        render[str(count)] = {
+            **summarize(samples),
+            "rendered": app.history_index.rendered_count(),
+        }
+    results["render"] = render
+    results["peak_rss_kb"] = peak_rss_kb()
+
+    app.backend.shutdown()
+    app.image_loader.shutdown()
+    root.destroy()
+    server.shutdown()
+    return {
+        "config": vars(args),
+        "environment": {
+            "python": platform.python_version(),
+            "tk": tk.TkVersion,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the GxChat client")
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=500, help="per group")
+    parser.add_argument("--like-density", type=float, default=0.2)
+    parser.add_argument("--image-density", type=float, default=0.1)
+    parser.add_argument("--switches", type=int, default=10)
+    parser.add_argument("--polls", type=int, default=20)
+    parser.add_argument(
+        "--render-sizes", type=int, nargs="+", default=[20, 50, 150, 500]
+    )
+    parser.add_argument("--render-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show", action="store_true", help="show the window")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
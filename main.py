@@ -1,35 +1,267 @@
+import bisect
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import sys
 import tkinter as tk
 from tkinter import font
 from tkinter import ttk
 import requests
 from datetime import datetime
-from PIL import Image, ImageTk
 import io
+import json
+import random
 import re
+import sqlite3
 import threading
 import time
+import uuid
 import webbrowser
-from queue import Queue
-from playsound import playsound
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+import websocket
+
+
+# Both can be pointed elsewhere, e.g. at the stub server in bench.py
+BACKEND_URL = os.environ.get("GXCHAT_BACKEND_URL", "http://127.0.0.1:3000")
+PUSH_URL = os.environ.get("GXCHAT_PUSH_URL", "https://push.groupme.com/faye")
+MESSAGE_PAGE_SIZE = 20  # Messages returned per request by the backend
+HISTORY_PAGE_SIZE = 50  # Older messages requested per page when scrolling back
+LIKES_POLL_INTERVAL = 30  # seconds between full refreshes to pick up new likes
+ETAG_CACHE_SIZE = 256  # Conditional requests whose last ETag is remembered
+OUTBOX_RETRY_BASE = 1.0  # seconds before the first retry of a failed send
+OUTBOX_RETRY_MAX = 60.0  # cap on the doubling retry delay
+OUTBOX_MAX_ATTEMPTS = 8  # sends of one message before it is given up
+QUEUE_DRAIN_BUDGET = 0.05  # seconds of push rendering before yielding to input
+LAG_HEARTBEAT_MS = 100  # Event-loop lag sampling period while metrics are on
+LAG_WARNING = 0.5  # seconds of event-loop lag worth a console warning
+HISTORY_WINDOW_SIZE = 150  # Most messages materialized in chat_history at once
+HISTORY_WINDOW_CHUNK = 50  # Messages materialized per step while scrolling
+HISTORY_WINDOW_EDGE = 0.1  # Fraction of the view that counts as near an end
+IMAGE_PLACEHOLDER = "[loading image...]"
+ANIMATION_MAX_FRAMES = 200  # Frames decoded per animated image, at most
+ANIMATION_MAX_BYTES = 16 * 1024 * 1024  # Decoded frames per animated image
+ANIMATION_DEFAULT_DELAY = 0.1  # seconds, for frames that ask for less than
+ANIMATION_MIN_DELAY = 0.02  # this (browsers treat them the same way)
+URL_PATTERN = re.compile(r"https?://\S+")
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "gxchat"
+)
+CONFIG_DIR = os.path.join(
+    os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "gxchat"
+)
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds")
+SOUND_COALESCE_WINDOW = 2.0  # seconds within which pings collapse into one
+CHANNEL_BUFFER_SIZE = 100  # Recent messages kept in memory for every channel
+MEMBER_LIST_CHUNK = 250  # Member rows added per step after the first screenful
+PREFETCH_CHANNELS = 3  # Cold channels warmed up ahead of the user opening them
+PREFETCH_DELAY_MS = 2000  # Lets bursts of activity settle before prefetching
+# Shared by decoded images and in-memory message caches
+MEMORY_BUDGET = int(os.environ.get("GXCHAT_MEMORY_MB", "128")) * 1024 * 1024
+# Tcl 8.6 holds text as UTF-16, so an emoji outside the BMP is two characters
+# to a Text index; later versions count code points like Python does
+TK_UTF16_INDICES = tk.TclVersion < 8.7
+
+
+def tk_length(text):
+    # Length of text in Text widget index characters
+    if TK_UTF16_INDICES and not text.isascii():
+        return len(text.encode("utf-16-le")) // 2
+    return len(text)
+
+
+class Backoff:
+    # Exponential backoff with jitter. Half of each delay is random so that
+    # many clients dropped at the same moment do not reconnect in lockstep.
+    def __init__(self, base=1, maximum=60):
+        self.base = base
+        self.maximum = maximum
+        self.attempts = 0
+
+    def next_delay(self):
+        ceiling = min(self.maximum, self.base * 2**self.attempts)
+        self.attempts += 1
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class Histogram:
+    # Latency histogram over fixed log-spaced buckets, in milliseconds
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket the percentile falls in, capped at the max
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            seen += count
+            if count and seen >= fraction * self.count:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def snapshot(self):
+        labels = [f"<={bound}" for bound in self.BOUNDS] + [f">{self.BOUNDS[-1]}"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": round(self.max, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class Metrics:
+    # Latency histograms and gauges for the hot paths, shared by every thread.
+    # Recording returns straight away while disabled, so the calls stay in
+    # place permanently.
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.gauges = {}  # name -> (last, max)
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds * 1000)
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            _, peak = self.gauges.get(name, (value, value))
+            self.gauges[name] = (value, max(peak, value))
+
+    def timed(self, name):
+        # Decorator recording how long each call takes
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorate
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.gauges.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "time": time.time(),
+                "histograms": {
+                    name: histogram.snapshot()
+                    for name, histogram in sorted(self.histograms.items())
+                },
+                "gauges": {
+                    name: {"last": last, "max": peak}
+                    for name, (last, peak) in sorted(self.gauges.items())
+                },
+            }
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def report(self):
+        # Plain-text table for the debug panel
+        snapshot = self.snapshot()
+        lines = [f"{'name':<36}{'count':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>10}"]
+        for name, h in snapshot["histograms"].items():
+            lines.append(
+                f"{name:<36}{h['count']:>8}{h['p50_ms']:>9}{h['p95_ms']:>9}"
+                f"{h['p99_ms']:>9}{h['max_ms']:>10}"
+            )
+        lines.append("")
+        for name, gauge in snapshot["gauges"].items():
+            lines.append(f"{name:<36}last {gauge['last']:<8}max {gauge['max']}")
+        return "\n".join(lines)
+
+
+# Off unless GXCHAT_METRICS=1 or switched on from the debug panel (F12)
+METRICS = Metrics(enabled=os.environ.get("GXCHAT_METRICS") == "1")
 
 
 class GroupMePushClient:
-    def __init__(self, access_token, user_id, message_queue, status_callback=None):
+    def __init__(
+        self,
+        access_token,
+        user_id,
+        message_queue,
+        status_callback=None,
+        message_callback=None,
+    ):
         self.access_token = access_token
         self.user_id = user_id
         self.message_queue = message_queue
         self.status_callback = status_callback
+        self.message_callback = message_callback  # Called after each put()
         self.client_id = None
-        self.faye_url = "https://push.groupme.com/faye"
+        self.faye_url = PUSH_URL
+        self.websocket_url = PUSH_URL.replace("http", "ws", 1)
         self.session = requests.Session()
         self.running = False
+        self.stop_event = threading.Event()
         self.message_id_counter = 0
-        self.reconnect_delay = 5  # seconds
+        self.backoff = Backoff()
+        # Bayeux advice from the server; timeout and interval are milliseconds
+        self.advice = {"reconnect": "retry", "interval": 0, "timeout": 30000}
+        self.connection_type = "long-polling"
+        self.websocket_supported = True  # Until a WebSocket fails to open
+        self.websocket = None
+        self.connect_sent_at = 0.0  # When the outstanding WebSocket connect went out
+
+    def _next_id(self):
+        self.message_id_counter += 1
+        return str(self.message_id_counter)
+
+    def _request_timeout(self):
+        # Long-polls are held open for up to advice["timeout"] by the server
+        return self.advice.get("timeout", 30000) / 1000 + 15
 
     def _send_faye_request(self, messages):
         headers = {"Content-Type": "application/json"}
         try:
-            response = self.session.post(self.faye_url, headers=headers, json=messages)
+            response = self.session.post(
+                self.faye_url,
+                headers=headers,
+                json=messages,
+                timeout=self._request_timeout(),
+            )
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -39,19 +271,33 @@ class GroupMePushClient:
             self.client_id = None  # Invalidate client_id to force re-handshake
             return None
 
+    def _update_advice(self, message):
+        if message.get("advice"):
+            self.advice.update(message["advice"])
+
     def handshake(self):
-        self.message_id_counter += 1
         handshake_message = {
             "channel": "/meta/handshake",
             "version": "1.0",
-            "supportedConnectionTypes": ["long-polling"],
-            "id": str(self.message_id_counter),
+            "supportedConnectionTypes": ["websocket", "long-polling"],
+            "id": self._next_id(),
         }
         response = self._send_faye_request([handshake_message])
         if response and response[0].get("successful"):
+            self._update_advice(response[0])
             self.client_id = response[0].get("clientId")
-            print(f"Faye handshake successful. Client ID: {self.client_id}")
+            supported = response[0].get("supportedConnectionTypes", [])
+            if self.websocket_supported and "websocket" in supported:
+                self.connection_type = "websocket"
+            else:
+                self.connection_type = "long-polling"
+            print(
+                f"Faye handshake successful. Client ID: {self.client_id} "
+                f"({self.connection_type})"
+            )
             return True
+        if response:
+            self._update_advice(response[0])
         return False
 
     def subscribe_user_channel(self):
@@ -59,12 +305,11 @@ class GroupMePushClient:
             print("Cannot subscribe: no client ID (perform handshake first).")
             return False
 
-        self.message_id_counter += 1
         subscribe_message = {
             "channel": "/meta/subscribe",
             "clientId": self.client_id,
             "subscription": f"/user/{self.user_id}",
-            "id": str(self.message_id_counter),
+            "id": self._next_id(),
             "ext": {"access_token": self.access_token, "timestamp": int(time.time())},
         }
         response = self._send_faye_request([subscribe_message])
@@ -73,6 +318,108 @@ class GroupMePushClient:
             return True
         return False
 
+    def _connect_message(self):
+        return {
+            "channel": "/meta/connect",
+            "clientId": self.client_id,
+            "connectionType": self.connection_type,
+            "id": self._next_id(),
+        }
+
+    def _handle_messages(self, messages):
+        # Returns False if the server told us to start over
+        for msg in messages:
+            if msg.get("channel") == f"/user/{self.user_id}" and msg.get("data"):
+                # Stamped so the UI can tell how long delivery to screen took
+                self.message_queue.put((time.perf_counter(), msg["data"]))
+                if self.message_callback:
+                    self.message_callback()
+            elif msg.get("channel") == "/meta/connect":
+                self._update_advice(msg)
+                if not msg.get("successful"):
+                    print("Faye connect message returned unsuccessful. Reconnecting...")
+                    return False
+                if self.advice.get("reconnect") == "handshake":
+                    return False
+        return True
+
+    def _handle_disconnect(self):
+        reconnect = self.advice.get("reconnect", "retry")
+        if reconnect == "none":
+            # The server asked us not to come back; a later start() begins
+            # again with a fresh handshake
+            print("Faye server advised not to reconnect. Stopping push client.")
+            self.running = False
+            self.client_id = None
+            if self.status_callback:
+                self.status_callback("disconnected")
+            return
+        if reconnect == "handshake" or not self.client_id:
+            self.client_id = None  # Force re-handshake
+        delay = max(self.backoff.next_delay(), self.advice.get("interval", 0) / 1000)
+        print(f"Faye connection lost. Retrying in {delay:.1f} seconds...")
+        self.stop_event.wait(delay)
+
+    def _poll_connection(self):
+        # One long-polling /meta/connect round trip. The server holds the
+        # request open until there is something to deliver, so there is no
+        # need to sleep between polls beyond what the advice asks for.
+        start = time.perf_counter()
+        response = self._send_faye_request([self._connect_message()])
+        METRICS.record("faye.connect", time.perf_counter() - start)
+        if not response or not self._handle_messages(response):
+            self._handle_disconnect()
+            return
+        self.backoff.reset()
+        interval = self.advice.get("interval", 0)
+        if interval:
+            self.stop_event.wait(interval / 1000)
+
+    def _run_websocket(self):
+        try:
+            self.websocket = websocket.create_connection(
+                self.websocket_url, timeout=self._request_timeout()
+            )
+        except (websocket.WebSocketException, OSError) as e:
+            # Fall back to long-polling for the rest of this session
+            print(f"Faye WebSocket unavailable ({e}), falling back to long-polling.")
+            self.websocket_supported = False
+            self.connection_type = "long-polling"
+            return
+
+        try:
+            self._send_websocket_connect()
+            while self.running and self.client_id:
+                messages = json.loads(self.websocket.recv())
+                if not self._handle_messages(messages):
+                    self._handle_disconnect()
+                    return
+                self.backoff.reset()
+                for msg in messages:
+                    if msg.get("channel") == "/meta/connect":
+                        METRICS.record(
+                            "faye.connect", time.perf_counter() - self.connect_sent_at
+                        )
+                        # Keep exactly one connect outstanding, as long-polling does
+                        interval = self.advice.get("interval", 0)
+                        if interval and self.stop_event.wait(interval / 1000):
+                            return
+                        self._send_websocket_connect()
+        except (websocket.WebSocketException, OSError, ValueError) as e:
+            if self.running:
+                print(f"Faye WebSocket failed: {e}")
+                if self.status_callback:
+                    self.status_callback("disconnected")
+                self.client_id = None
+                self._handle_disconnect()
+        finally:
+            self.websocket.close()
+            self.websocket = None
+
+    def _send_websocket_connect(self):
+        self.connect_sent_at = time.perf_counter()
+        self.websocket.send(json.dumps([self._connect_message()]))
+
     def connect(self):
         while self.running:
             if not self.client_id:
@@ -84,48 +431,1795 @@ class GroupMePushClient:
                     if self.status_callback:
                         self.status_callback("connected")
                 else:
-                    print(
-                        f"Failed to re-establish Faye connection. Retrying in {self.reconnect_delay} seconds..."
-                    )
                     if self.status_callback:
                         self.status_callback("disconnected")
-                    time.sleep(self.reconnect_delay)
+                    self._handle_disconnect()
                     continue  # Skip to next iteration to retry handshake
 
-            self.message_id_counter += 1
-            connect_message = {
-                "channel": "/meta/connect",
-                "clientId": self.client_id,
-                "connectionType": "long-polling",
-                "id": str(self.message_id_counter),
-            }
-            response = self._send_faye_request([connect_message])
-            if response:
-                for msg in response:
-                    if msg.get("channel") == f"/user/{self.user_id}" and msg.get(
-                        "data"
-                    ):
-                        self.message_queue.put(msg["data"])
-                    elif msg.get("channel") == "/meta/connect" and not msg.get(
-                        "successful"
-                    ):
-                        print(
-                            "Faye connect message returned unsuccessful. Reconnecting..."
-                        )
-                        self.client_id = None  # Force re-handshake
-                        time.sleep(self.reconnect_delay)
-                        break  # Exit inner loop to start reconnection process
-            time.sleep(1)  # Poll every second
+            if self.connection_type == "websocket":
+                self._run_websocket()
+            else:
+                self._poll_connection()
 
     def start(self):
         self.running = True
+        self.stop_event.clear()
         threading.Thread(target=self.connect, daemon=True).start()
 
     def stop(self):
         self.running = False
+        self.stop_event.set()
+        ws = self.websocket
+        if ws is not None:
+            ws.abort()  # Unblock recv()
         print("GroupMe push client stopped.")
 
 
+class BackendRequest:
+    # Handle for an in-flight backend call. Cancelling it guarantees its
+    # callbacks never run, even if the response has already arrived.
+    def __init__(self, tag=None):
+        self.tag = tag
+        self.future = None
+        self.cancelled = False
+        self.done = False
+
+    def cancel(self):
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+
+
+class BackendClient:
+    # All calls to the local backend go through one keep-alive session and run
+    # on a background executor. Results are delivered on the Tk thread via
+    # after(), and requests sharing a tag can be cancelled together, e.g. when
+    # the user leaves a channel before its responses arrive.
+    #
+    # Conditional requests send the ETag of the last response for the same
+    # path and params. When the backend answers 304 the body is never parsed
+    # and only the not_modified callback runs.
+    NOT_MODIFIED = object()
+
+    def __init__(self, widget, base_url=BACKEND_URL, max_workers=4, timeout=30):
+        self.widget = widget
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="backend"
+        )
+        self.tagged = {}  # tag -> set of in-flight BackendRequests
+        # (method, path, params) -> ETag; only touched on the Tk thread
+        self.etags = LRUCache(ETAG_CACHE_SIZE)
+
+    def get(self, path, callback=None, errback=None, tag=None, **kwargs):
+        return self.request("GET", path, callback, errback, tag, **kwargs)
+
+    def post(self, path, callback=None, errback=None, tag=None, **kwargs):
+        return self.request("POST", path, callback, errback, tag, **kwargs)
+
+    def request(
+        self,
+        method,
+        path,
+        callback=None,
+        errback=None,
+        tag=None,
+        conditional=False,
+        not_modified=None,
+        **kwargs,
+    ):
+        handle = BackendRequest(tag)
+        if tag is not None:
+            self.tagged.setdefault(tag, set()).add(handle)
+        etag_key = None
+        if conditional:
+            params = kwargs.get("params") or {}
+            etag_key = (method, path, tuple(sorted(params.items())))
+            etag = self.etags.get(etag_key)
+            if etag:
+                kwargs["headers"] = {**kwargs.get("headers", {}), "If-None-Match": etag}
+        handle.future = self.executor.submit(self._send, method, path, kwargs)
+        handle.future.add_done_callback(
+            lambda f: self.widget.after(
+                0, self._deliver, handle, callback, errback, etag_key, not_modified
+            )
+        )
+        return handle
+
+    def cancel(self, tag):
+        for handle in self.tagged.pop(tag, ()):
+            handle.cancel()
+
+    def _send(self, method, path, kwargs):
+        # Runs on a worker thread
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, self.base_url + path, timeout=self.timeout, **kwargs
+            )
+            response.raise_for_status()
+            if response.status_code == 304:
+                return self.NOT_MODIFIED, None
+            return response.json(), response.headers.get("ETag")
+        finally:
+            if METRICS.enabled:
+                # One histogram per route, not per group
+                route = re.sub(r"/\d+", "/:id", path)
+                METRICS.record(f"backend {method} {route}", time.perf_counter() - start)
+
+    def _deliver(self, handle, callback, errback, etag_key=None, not_modified=None):
+        handle.done = True
+        if handle.tag is not None:
+            self.tagged.get(handle.tag, set()).discard(handle)
+        if handle.cancelled:
+            return  # Nobody is interested in this response any more
+        try:
+            result, etag = handle.future.result()
+        except requests.exceptions.RequestException as e:
+            if errback:
+                errback(e)
+            return
+        if result is self.NOT_MODIFIED:
+            if not_modified:
+                not_modified()
+            return
+        if etag_key is not None and etag:
+            self.etags.put(etag_key, etag)
+        if callback:
+            callback(result)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+class OutboxEntry:
+    __slots__ = ("guid", "group_id", "text", "attempts", "status", "retry_in")
+
+    def __init__(self, group_id, text):
+        # Generated here rather than by the backend so the echo that comes
+        # back through push or a fetch can be matched to this entry. GroupMe
+        # also dedupes on it, so a retry after a lost response cannot post
+        # the message twice.
+        self.guid = uuid.uuid4().hex
+        self.group_id = group_id
+        self.text = text
+        self.attempts = 0
+        self.status = "sending"  # "sending", "retrying" or "failed"
+        self.retry_in = 0.0
+
+
+class Outbox:
+    # Messages typed but not yet confirmed, oldest first. They go out one at a
+    # time through the backend client, so they land in the order they were
+    # typed; a failed send is retried with exponential backoff and holds back
+    # the ones behind it. One that keeps failing stays in the outbox as
+    # failed, out of the way of the rest, until retry() gives it another go.
+    # on_change(entry) runs whenever an entry's status changes and
+    # on_sent(entry, message) once the backend returns the posted message.
+    # Everything runs on the Tk thread.
+    def __init__(self, backend, widget, on_change, on_sent):
+        self.backend = backend
+        self.widget = widget
+        self.on_change = on_change
+        self.on_sent = on_sent
+        self.entries = OrderedDict()  # guid -> OutboxEntry
+        self.in_flight = None
+        self.retry_job = None
+        self.retry_guid = None  # The entry retry_job is waiting to resend
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, group_id, text):
+        entry = OutboxEntry(group_id, text)
+        self.entries[entry.guid] = entry
+        self._pump()
+        return entry
+
+    def pending(self, group_id):
+        return [entry for entry in self.entries.values() if entry.group_id == group_id]
+
+    def confirm(self, guid):
+        # The echo of a sent message arrived. Returns its entry, or None if
+        # the guid is not ours (or was already confirmed).
+        entry = self.entries.pop(guid, None) if guid else None
+        if entry is not None and self.retry_job is not None and guid == self.retry_guid:
+            # It went through after all; stop waiting to retry it
+            self.widget.after_cancel(self.retry_job)
+            self.retry_job = None
+            self.retry_guid = None
+            self._pump()
+        return entry
+
+    def retry(self, guid):
+        entry = self.entries.get(guid)
+        if entry is None or entry.status != "failed":
+            return
+        entry.attempts = 0
+        entry.status = "sending"
+        self.on_change(entry)
+        self._pump()
+
+    def _pump(self):
+        if self.in_flight is not None or self.retry_job is not None:
+            return
+        entry = next(
+            (entry for entry in self.entries.values() if entry.status != "failed"),
+            None,
+        )
+        if entry is None:
+            return
+        self.in_flight = entry
+        if entry.attempts:
+            entry.status = "sending"
+            self.on_change(entry)
+        self.backend.post(
+            f"/groups/{entry.group_id}/messages",
+            callback=lambda message: self._on_sent(entry, message),
+            errback=lambda e: self._on_failed(entry, e),
+            json={"text": entry.text, "source_guid": entry.guid},
+        )
+
+    def _on_sent(self, entry, message):
+        self.in_flight = None
+        # Already gone if its echo beat the response here
+        if self.entries.pop(entry.guid, None) is not None:
+            self.on_sent(entry, message)
+        self._pump()
+
+    def _on_failed(self, entry, error):
+        self.in_flight = None
+        if entry.guid not in self.entries:
+            self._pump()
+            return
+        entry.attempts += 1
+        if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+            print(f"Giving up on message after {entry.attempts} attempts: {error}")
+            entry.status = "failed"
+            self.on_change(entry)
+            self._pump()
+            return
+        delay = min(OUTBOX_RETRY_BASE * 2 ** (entry.attempts - 1), OUTBOX_RETRY_MAX)
+        entry.retry_in = delay * random.uniform(0.8, 1.2)
+        entry.status = "retrying"
+        self.on_change(entry)
+        self.retry_guid = entry.guid
+        self.retry_job = self.widget.after(int(entry.retry_in * 1000), self._retry)
+
+    def _retry(self):
+        self.retry_job = None
+        self.retry_guid = None
+        self._pump()
+
+
+class LRUCache:
+    # Least-recently-used cache bounded by the total size of its values, as
+    # reported by the sizeof callable (entry count by default).
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.entries = OrderedDict()  # key -> (value, size, last used)
+        self.total_size = 0
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        self.entries[key] = (entry[0], entry[1], time.monotonic())
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        self.pop(key)
+        size = self.sizeof(value)
+        self.entries[key] = (value, size, time.monotonic())
+        self.total_size += size
+        # Never evict the entry we just added, even if it alone is too big
+        while self.total_size > self.max_size and len(self.entries) > 1:
+            self.evict_oldest()
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+        self.total_size -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        self.entries.clear()
+        self.total_size = 0
+
+    # MemoryBudget consumer interface
+
+    def memory_usage(self):
+        return self.total_size
+
+    def oldest_view(self):
+        return next(iter(self.entries.values()))[2] if self.entries else None
+
+    def evict_oldest(self):
+        _, (_, size, _) = self.entries.popitem(last=False)
+        self.total_size -= size
+        return size
+
+
+class MemoryBudget:
+    # One memory budget shared by the in-memory caches. Each consumer reports
+    # its size and when its least recently viewed entry was last looked at;
+    # over budget, entries are evicted oldest first across all of them.
+    # Consumers that cannot shed anything still count towards the total.
+    def __init__(self, max_bytes=MEMORY_BUDGET):
+        self.max_bytes = max_bytes
+        self.consumers = {}  # name -> consumer
+
+    def register(self, name, consumer):
+        self.consumers[name] = consumer
+
+    def usage(self):
+        return {name: c.memory_usage() for name, c in self.consumers.items()}
+
+    def enforce(self):
+        # Returns the bytes evicted
+        total = sum(self.usage().values())
+        evicted = 0
+        while total > self.max_bytes:
+            candidates = [
+                (viewed, name)
+                for name, consumer in self.consumers.items()
+                if (viewed := consumer.oldest_view()) is not None
+            ]
+            if not candidates:
+                break
+            freed = self.consumers[min(candidates)[1]].evict_oldest()
+            total -= freed
+            evicted += freed
+        return evicted
+
+    def report(self):
+        usage = self.usage()
+        lines = [f"memory budget {self.max_bytes / 2**20:.1f} MiB"]
+        for name, used in sorted(usage.items()):
+            lines.append(f"  {name:<34}{used / 2**20:>8.2f} MiB")
+        lines.append(f"  {'total':<34}{sum(usage.values()) / 2**20:>8.2f} MiB")
+        return "\n".join(lines)
+
+
+class DiskCache:
+    # Content-addressed file store: each entry is named after the SHA-256 of
+    # its key and the directory is bounded by total size, evicting the least
+    # recently used files first. Reads are memory-mapped rather than copied
+    # through Python file buffers.
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # filename -> size, least recently used first
+        self.total_size = 0
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+        except OSError as e:
+            print(f"Disk cache unavailable at {directory}: {e}")
+
+    @staticmethod
+    def key_name(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _scan(self):
+        # Rebuild the LRU order from file modification times, which open()
+        # bumps on every hit so recency survives restarts.
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                os.remove(entry.path)  # Left behind by an interrupted write
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_size += size
+        with self.lock:
+            self._evict()
+
+    def open(self, key):
+        # Returns a read-only mmap of the cached file or None. Caller closes it.
+        name = self.key_name(key)
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = self._path(name)
+        try:
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.total_size -= self.entries.pop(name, 0)
+            return None
+        return mapped
+
+    def put(self, key, data):
+        if not data:
+            return  # Empty files cannot be memory-mapped
+        name = self.key_name(key)
+        path = self._path(name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)  # Readers never see a partial file
+        except OSError as e:
+            print(f"Failed to write {path} to disk cache: {e}")
+            return
+        with self.lock:
+            self.total_size -= self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.total_size += len(data)
+            self._evict()
+
+    def _evict(self):
+        # Caller holds the lock
+        while self.total_size > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.total_size -= size
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+
+class ImageLoader:
+    # Downloads and scales images on a small worker pool and hands finished
+    # PhotoImages back to the Tk thread. Thumbnails are kept in an LRU keyed
+    # by URL and target size, so rendering the same image again is free.
+    def __init__(
+        self, widget, max_workers=4, cache_bytes=64 * 1024 * 1024, disk_cache=None
+    ):
+        self.widget = widget
+        self.disk_cache = disk_cache
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="image-loader"
+        )
+        self.cache = LRUCache(cache_bytes, sizeof=self.image_bytes)
+        self.pending = {}  # (url, max_size) -> callbacks waiting on the download
+        self.local = threading.local()  # One requests.Session per worker
+
+    @staticmethod
+    def image_bytes(image):
+        if isinstance(image, Animation):
+            return image.nbytes()
+        return image.width() * image.height() * 4
+
+    def cached(self, url, max_size):
+        return self.cache.get((url, max_size))
+
+    def load(self, url, max_size, callback):
+        # callback(photo, error) always runs on the Tk thread. Animated images
+        # arrive as an Animation rather than a PhotoImage.
+        key = (url, max_size)
+        photo = self.cache.get(key)
+        if photo is not None:
+            callback(photo, None)
+            return
+        if key in self.pending:
+            self.pending[key].append(callback)  # Already being downloaded
+            return
+        self.pending[key] = [callback]
+        future = self.executor.submit(self._fetch, url, max_size)
+        future.add_done_callback(lambda f: self.widget.after(0, self._deliver, key, f))
+
+    @METRICS.timed("image.fetch")
+    def _fetch(self, url, max_size):
+        # Runs on a worker thread: everything except creating the PhotoImage.
+        # Returns a PIL image, or (frames, delays) for an animated one.
+        # (Versioned: before animations, GIFs were stored here as stills.)
+        thumbnail_key = f"{url}#thumbnail-v2={max_size[0]}x{max_size[1]}"
+        image = self._read_thumbnail(thumbnail_key)
+        if image is not None:
+            return image
+
+        mapped = self.disk_cache.open(url) if self.disk_cache else None
+        if mapped is not None:
+            with mapped:
+                image = self._scale(mapped, max_size)
+        else:
+            session = getattr(self.local, "session", None)
+            if session is None:
+                session = self.local.session = requests.Session()
+            response = session.get(url, timeout=30)
+            response.raise_for_status()
+            if self.disk_cache:
+                self.disk_cache.put(url, response.content)
+            image = self._scale(io.BytesIO(response.content), max_size)
+
+        if self.disk_cache and not isinstance(image, tuple):
+            # Thumbnails are stored as raw RGBA so reading one back is a copy,
+            # not a decode
+            header = struct.pack("<II", *image.size)
+            self.disk_cache.put(thumbnail_key, header + image.tobytes())
+        return image
+
+    @classmethod
+    def _scale(cls, source, max_size):
+        # PIL is only imported once the first image shows up
+        from PIL import Image
+
+        image = Image.open(source)
+        if image.format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while that still
+            # leaves twice the thumbnail size, rather than every pixel of a
+            # phone photo; LANCZOS takes it the rest of the way
+            image.draft("RGB", (max_size[0] * 2, max_size[1] * 2))
+        if getattr(image, "is_animated", False):
+            return cls._scale_frames(image, max_size)
+        image.thumbnail(max_size, Image.Resampling.LANCZOS)
+
+        # Ensure image is in RGBA mode for PhotoImage compatibility
+        image = image.convert("RGBA")
+
+        # Explicitly load the image data to ensure it's fully processed
+        image.load()
+        return image
+
+    @staticmethod
+    def _scale_frames(image, max_size):
+        # Every frame is decoded and scaled once, here, so playing the
+        # animation later is only a matter of swapping frames
+        from PIL import Image, ImageSequence
+
+        frames = []
+        delays = []
+        total = 0
+        for frame in ImageSequence.Iterator(image):
+            frame = frame.convert("RGBA")
+            frame.thumbnail(max_size, Image.Resampling.LANCZOS)
+            total += frame.width * frame.height * 4
+            if frames and (
+                len(frames) >= ANIMATION_MAX_FRAMES or total > ANIMATION_MAX_BYTES
+            ):
+                break  # Play the frames we kept in a loop
+            delay = (frame.info.get("duration") or 0) / 1000
+            frames.append(frame)
+            delays.append(
+                delay if delay >= ANIMATION_MIN_DELAY else ANIMATION_DEFAULT_DELAY
+            )
+        return frames, delays
+
+    def _read_thumbnail(self, key):
+        mapped = self.disk_cache.open(key) if self.disk_cache else None
+        if mapped is None:
+            return None
+        from PIL import Image
+
+        with mapped:
+            try:
+                size = struct.unpack_from("<II", mapped)
+                with memoryview(mapped) as view:
+                    return Image.frombytes("RGBA", size, view[8:])
+            except (struct.error, ValueError) as e:
+                print(f"Ignoring corrupt thumbnail in disk cache: {e}")
+                return None
+
+    def _deliver(self, key, future):
+        from PIL import ImageTk
+
+        callbacks = self.pending.pop(key, [])
+        try:
+            result = future.result()
+            if isinstance(result, tuple):
+                frames, delays = result
+                photo = Animation([ImageTk.PhotoImage(f) for f in frames], delays)
+            else:
+                photo = ImageTk.PhotoImage(result)
+        except Exception as e:
+            for callback in callbacks:
+                callback(None, e)
+            return
+        self.cache.put(key, photo)
+        for callback in callbacks:
+            callback(photo, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Animation:
+    # The frames of an animated image, already scaled, as PhotoImages along
+    # with how long each one stays up
+    __slots__ = ("frames", "delays")
+
+    def __init__(self, frames, delays):
+        self.frames = frames
+        self.delays = delays
+
+    def width(self):
+        return self.frames[0].width()
+
+    def height(self):
+        return self.frames[0].height()
+
+    def nbytes(self):
+        return sum(frame.width() * frame.height() * 4 for frame in self.frames)
+
+
+class AnimationTicker:
+    # Plays every animated image in a Text widget from a single after()
+    # timer, firing when the next visible frame is due. Only animations on
+    # screen advance; the rest pause on their current frame until scrolling
+    # brings them back, so the cost of a tick is bounded by what fits in the
+    # view. Which ones are on screen is worked out when the view changes,
+    # not on every tick.
+    def __init__(self, text):
+        self.text = text
+        self.playing = {}  # key -> [animation, display, embed name, frame, due]
+        self.visible = set()
+        self.job = None
+        self.refresh_job = None
+
+    def __len__(self):
+        return len(self.playing)
+
+    def add(self, key, animation, display, name):
+        self.playing[key] = [animation, display, name, 0, 0.0]
+        self.view_changed()
+
+    def remove(self, key):
+        if self.playing.pop(key, None) is not None:
+            self.visible.discard(key)
+
+    def view_changed(self):
+        # Scrolling fires in bursts; one visibility pass per burst is enough
+        if self.refresh_job is None:
+            self.refresh_job = self.text.after_idle(self._refresh)
+
+    def _refresh(self):
+        self.refresh_job = None
+        visible = set()
+        if self.text.winfo_viewable():
+            for key, playback in self.playing.items():
+                try:
+                    if self.text.dlineinfo(playback[2]) is not None:
+                        visible.add(key)
+                except tk.TclError:
+                    pass  # Its line was deleted before we got to it
+        now = time.monotonic()
+        for key in visible - self.visible:
+            # Resume where it paused, with the current frame shown in full
+            playback = self.playing[key]
+            playback[4] = now + playback[0].delays[playback[3]]
+        self.visible = visible
+        self._schedule()
+
+    def _schedule(self):
+        if self.job is not None:
+            self.text.after_cancel(self.job)
+            self.job = None
+        if not self.visible:
+            return  # Nothing on screen moves, so no timer at all
+        due = min(self.playing[key][4] for key in self.visible)
+        delay = max(int((due - time.monotonic()) * 1000), 1)
+        self.job = self.text.after(delay, self._tick)
+
+    @METRICS.timed("animation.tick")
+    def _tick(self):
+        self.job = None
+        now = time.monotonic()
+        for key in self.visible:
+            playback = self.playing[key]
+            animation, display, _, frame, due = playback
+            if now < due:
+                continue
+            frame = (frame + 1) % len(animation.frames)
+            display.tk.call(
+                display, "copy", animation.frames[frame], "-compositingrule", "set"
+            )
+            playback[3] = frame
+            # Running late skips ahead instead of racing to catch up
+            playback[4] = max(due + animation.delays[frame], now)
+        self._schedule()
+
+
+class SoundPlayer:
+    # Plays notification sounds from one long-lived worker thread. Requests
+    # that arrive while a sound is playing, or within `window` seconds of the
+    # last one, collapse into a single sound, and a pending mention replaces a
+    # pending ping. Mentions do not wait out the window.
+    #
+    # Nothing is preloaded: playsound only takes a file path and decodes the
+    # file again on every play. What is done once is resolving each sound's
+    # path and checking that the file exists.
+    SOUNDS = {"ping": "ping.mp3", "mention": "mentioned.mp3"}
+    PRIORITY = {"ping": 0, "mention": 1}
+
+    def __init__(self, directory, window=SOUND_COALESCE_WINDOW):
+        self.paths = {}  # name -> path of a sound file known to exist
+        for name, filename in self.SOUNDS.items():
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                self.paths[name] = path
+            else:
+                print(f"Sound file {path} not found, {name} sounds are off.")
+        self.window = window
+        self.condition = threading.Condition()
+        self.pending = None
+        self.last_played = float("-inf")
+        self.running = True
+        self.thread = None
+
+    def play(self, name):
+        if name not in self.paths:
+            return
+        with self.condition:
+            if not self.running:
+                return
+            if (
+                self.pending is None
+                or self.PRIORITY[name] > self.PRIORITY[self.pending]
+            ):
+                self.pending = name
+            self.condition.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _next_sound(self):
+        # Blocks until a sound is due; None once stopped
+        with self.condition:
+            while self.running:
+                if self.pending == "mention":
+                    break
+                if self.pending == "ping":
+                    remaining = self.last_played + self.window - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+            if not self.running:
+                return None
+            name, self.pending = self.pending, None
+            self.last_played = time.monotonic()
+            return name
+
+    def _run(self):
+        # Imported on the worker, so the first sound pays for it, not startup
+        try:
+            from playsound import playsound
+        except ImportError as e:
+            print(f"Sound notifications unavailable: {e}")
+            return
+
+        while True:
+            name = self._next_sound()
+            if name is None:
+                return
+            try:
+                playsound(self.paths[name])  # Blocks until the sound is done
+            except Exception as e:
+                print(f"Error playing sound: {e}")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+
+class PollInterval:
+    # Decides how long to wait before polling the open channel for new
+    # messages again. Activity pulls the interval down to the minimum, quiet
+    # polls let it grow, and the ceiling depends on whether the push client
+    # is already delivering messages to us.
+    def __init__(self, minimum=2, connected_maximum=60, disconnected_maximum=5):
+        self.minimum = minimum
+        self.connected_maximum = connected_maximum
+        self.disconnected_maximum = disconnected_maximum
+        self.push_status = "disconnected"
+        self.interval = minimum
+
+    @property
+    def maximum(self):
+        if self.push_status == "connected":
+            return self.connected_maximum
+        return self.disconnected_maximum
+
+    def record(self, found_new_messages):
+        if found_new_messages:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.interval * 1.5, self.maximum)
+
+    def set_push_status(self, status):
+        self.push_status = status
+        self.interval = min(self.interval, self.maximum)
+
+    def reset(self):
+        self.interval = self.minimum
+
+    def next_delay_ms(self):
+        return int(self.interval * 1000)
+
+
+class RosterCache:
+    # Groups as last fetched from the backend, plus a user_id -> nickname
+    # index per group built once per refresh. The roster is trusted for `ttl`
+    # seconds, or until a group is invalidated by a membership event.
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.groups = {}  # group_id -> group
+        self.nicknames = {}  # group_id -> {user_id: nickname}
+        self.fetched_at = None
+        self.stale_group_ids = set()
+
+    def update(self, groups):
+        self.groups = {group["id"]: group for group in groups}
+        self.nicknames = {
+            group["id"]: {
+                member["user_id"]: member["nickname"]
+                for member in group.get("members", [])
+            }
+            for group in groups
+        }
+        self.fetched_at = time.monotonic()
+        self.stale_group_ids.clear()
+
+    def is_fresh(self, group_id):
+        return (
+            self.fetched_at is not None
+            and time.monotonic() - self.fetched_at < self.ttl
+            and group_id in self.groups
+            and group_id not in self.stale_group_ids
+        )
+
+    def invalidate(self, group_id=None):
+        if group_id is None:
+            self.fetched_at = None
+        else:
+            self.stale_group_ids.add(group_id)
+
+    def get(self, group_id):
+        return self.groups.get(group_id)
+
+    def nickname(self, group_id, user_id, default="Unknown User"):
+        return self.nicknames.get(group_id, {}).get(user_id, default)
+
+
+class MessageRecord:
+    # Compact in-memory form of a message. Payloads from the network and the
+    # store stay JSON dicts; whatever is held in memory for long (the open
+    # channel's model and the per-group buffers) is kept as these. Ids and
+    # names repeat across thousands of messages, so they are interned.
+    __slots__ = (
+        "id",
+        "group_id",
+        "name",
+        "sender_id",
+        "text",
+        "created_at",
+        "image_url",
+        "favorited_by",
+        "mentions",
+    )
+
+    def __init__(
+        self,
+        id,
+        group_id,
+        name,
+        sender_id,
+        text,
+        created_at,
+        image_url,
+        favorited_by,
+        mentions=(),
+    ):
+        self.id = id
+        self.group_id = group_id
+        self.name = name
+        self.sender_id = sender_id
+        self.text = text
+        self.created_at = created_at
+        self.image_url = image_url
+        self.favorited_by = favorited_by
+        self.mentions = mentions  # (user_id, start, length) per mention
+
+    @staticmethod
+    def _intern(value):
+        return sys.intern(value) if isinstance(value, str) else value
+
+    @classmethod
+    def of(cls, message):
+        # Accepts a record or a GroupMe message payload
+        if isinstance(message, cls):
+            return message
+        image_url = None
+        mentions = ()
+        for attachment in message.get("attachments") or ():
+            if attachment.get("type") == "image" and image_url is None:
+                image_url = attachment.get("url")
+            elif attachment.get("type") == "mentions":
+                mentions = tuple(
+                    (cls._intern(user_id), locus[0], locus[1])
+                    for user_id, locus in zip(
+                        attachment.get("user_ids") or (), attachment.get("loci") or ()
+                    )
+                    if len(locus) == 2
+                )
+        return cls(
+            cls._intern(message.get("id")),
+            cls._intern(message.get("group_id")),
+            cls._intern(message.get("name") or "Unknown"),
+            cls._intern(message.get("sender_id")),
+            message.get("text") or "",
+            message.get("created_at", 0),
+            image_url,
+            tuple(
+                cls._intern(user_id) for user_id in message.get("favorited_by") or ()
+            ),
+            mentions,
+        )
+
+    @property
+    def key(self):
+        # Sort key: oldest first, ties broken by id
+        return (self.created_at, self.id)
+
+    def nbytes(self):
+        # Interned strings are shared between records, so only count ours
+        return (
+            sys.getsizeof(self)
+            + sys.getsizeof(self.text)
+            + sys.getsizeof(self.favorited_by)
+            + (sys.getsizeof(self.mentions) if self.mentions else 0)
+        )
+
+
+class HighlightEngine:
+    # Decides which messages deserve the user's attention, for every group at
+    # once. The user's nickname in each group (as "@nickname") and the custom
+    # keywords are folded into a single trie-shaped regex, so a message is
+    # scanned once however many literals there are; custom regex rules join
+    # the same pattern as further alternatives. A nickname only counts in the
+    # group where it is the user's. Mentions attachments that name the user
+    # count as well, wherever they point.
+    #
+    # A rule only joins the shared pattern if wrapping it cannot change what
+    # it means: inline global flags like (?i) are an error anywhere but the
+    # start, and wrapping renumbers groups under backreferences. Such rules
+    # (and everything, should the joined pattern fail to compile) are
+    # matched on their own instead.
+    STANDALONE_RULE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]+\)")
+
+    def __init__(self, keywords=(), patterns=()):
+        self.keywords = [k for k in keywords if k]
+        self.patterns = []
+        self.standalone = []  # compiled rules scanned separately
+        for pattern in patterns:
+            try:
+                compiled = re.compile(pattern, re.IGNORECASE)
+            except (re.error, TypeError) as e:
+                print(f"Ignoring highlight rule {pattern!r}: {e}")
+                continue
+            if self.STANDALONE_RULE.search(pattern):
+                self.standalone.append(compiled)
+            else:
+                self.patterns.append(pattern)
+        self.user_id = None
+        self.nicknames = {}  # group_id -> the user's nickname there
+        self.literals = {}  # lowercased literal -> group_ids, or None for all
+        self.matcher = None
+        self.compile()
+
+    def set_identity(self, user_id, nicknames):
+        if user_id == self.user_id and nicknames == self.nicknames:
+            return
+        self.user_id = user_id
+        self.nicknames = dict(nicknames)
+        self.compile()
+
+    def compile(self):
+        literals = {}
+        for group_id, nickname in self.nicknames.items():
+            key = f"@{nickname}".lower()
+            owners = literals.setdefault(key, set())
+            if owners is not None:
+                owners.add(group_id)
+        for keyword in self.keywords:
+            literals[keyword.lower()] = None
+        self.literals = literals
+        alternatives = []
+        if literals:
+            trie = self.trie_pattern(literals)
+            alternatives.append(rf"(?P<literal>(?<!\w){trie}(?!\w))")
+        alternatives.extend(f"(?:{pattern})" for pattern in self.patterns)
+        try:
+            self.matcher = (
+                re.compile("|".join(alternatives), re.IGNORECASE)
+                if alternatives
+                else None
+            )
+        except re.error as e:
+            print(f"Highlight rules do not combine ({e}); matching them one by one")
+            self.standalone.extend(
+                re.compile(pattern, re.IGNORECASE) for pattern in self.patterns
+            )
+            self.patterns = []
+            self.compile()
+
+    @staticmethod
+    def trie_pattern(words):
+        # "ab", "abc" and "ad" become a(?:b(?:c)?|d): shared prefixes are
+        # matched once, so adding a word barely changes the cost of a scan
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[""] = {}
+
+        def emit(node):
+            branches = [
+                re.escape(char) + emit(child)
+                for char, child in sorted(node.items())
+                if char
+            ]
+            if not branches:
+                return ""
+            pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+            return f"(?:{pattern})?" if "" in node else pattern
+
+        return emit(trie)
+
+    def spans(self, message):
+        # (start, end) offsets into message.text of everything that matched.
+        # The user's own messages never highlight.
+        if message.sender_id is not None and message.sender_id == self.user_id:
+            return
+        for user_id, start, length in message.mentions:
+            if user_id == self.user_id and 0 <= start < len(message.text):
+                yield start, min(start + length, len(message.text))
+        if self.matcher is not None:
+            for match in self.matcher.finditer(message.text):
+                if match.lastgroup == "literal":
+                    owners = self.literals.get(match.group().lower())
+                    if owners is not None and message.group_id not in owners:
+                        continue
+                if match.end() > match.start():
+                    yield match.span()
+        for rule in self.standalone:
+            for match in rule.finditer(message.text):
+                if match.end() > match.start():
+                    yield match.span()
+
+    def matches(self, message):
+        return next(self.spans(message), None) is not None
+
+
+class ChannelBuffers:
+    # A bounded tail of recent messages for every group, fed by push events
+    # for all of them, plus unread counts and last activity. A buffer is warm
+    # while it is known to hold the group's latest messages without gaps: it
+    # was seeded from a complete tail while push was connected, and push has
+    # stayed connected since. Losing push cools every buffer, since events
+    # may have been missed in the meantime.
+    def __init__(self, size=CHANNEL_BUFFER_SIZE):
+        self.size = size
+        self.buffers = {}  # group_id -> {message_id: MessageRecord}
+        self.warm = set()
+        self.unread = {}  # group_id -> count
+        self.highlighted = {}  # group_id -> unread messages that highlight
+        self.last_activity = {}  # group_id -> created_at of the newest message
+        self.viewed_at = {}  # group_id -> when the channel was last opened
+        self.connected = False
+        self.bytes = 0
+
+    def add(self, message):
+        group_id = message.group_id
+        buffer = self.buffers.setdefault(group_id, {})
+        previous = buffer.get(message.id)
+        if previous is not None:
+            self.bytes -= previous.nbytes()
+        buffer[message.id] = message
+        self.bytes += message.nbytes()
+        if len(buffer) > self.size:
+            oldest = min(buffer, key=lambda i: buffer[i].key)
+            self.bytes -= buffer.pop(oldest).nbytes()
+        if message.created_at > self.last_activity.get(group_id, 0):
+            self.last_activity[group_id] = message.created_at
+
+    def seed(self, group_id, messages):
+        # `messages` must be the group's latest messages, with no gaps
+        buffer = self.buffers.get(group_id)
+        if buffer and messages and group_id not in self.warm:
+            # What a cold buffer holds from before the seed may not connect
+            # to it, so drop it rather than leave a hole in the history
+            oldest = min(message.key for message in messages)
+            for message_id, message in list(buffer.items()):
+                if message.key < oldest:
+                    self.bytes -= buffer.pop(message_id).nbytes()
+        for message in messages:
+            self.add(message)
+        self.viewed_at.setdefault(group_id, time.monotonic())
+        if self.connected:
+            self.warm.add(group_id)
+
+    def messages(self, group_id):
+        return sorted(self.buffers.get(group_id, {}).values(), key=lambda m: m.key)
+
+    def is_warm(self, group_id):
+        return group_id in self.warm and bool(self.buffers.get(group_id))
+
+    def viewed(self, group_id):
+        self.viewed_at[group_id] = time.monotonic()
+
+    # MemoryBudget consumer interface: whole buffers, least recently opened
+    # channel first
+
+    def memory_usage(self):
+        return self.bytes
+
+    def oldest_view(self):
+        if not self.buffers:
+            return None
+        return min(self.viewed_at.get(group_id, 0) for group_id in self.buffers)
+
+    def evict_oldest(self):
+        group_id = min(self.buffers, key=lambda g: self.viewed_at.get(g, 0))
+        freed = sum(message.nbytes() for message in self.buffers.pop(group_id).values())
+        self.bytes -= freed
+        self.warm.discard(group_id)
+        return freed
+
+    def set_connected(self, connected):
+        self.connected = connected
+        if not connected:
+            self.warm.clear()
+
+    def mark_unread(self, group_id, highlight=False):
+        self.unread[group_id] = self.unread.get(group_id, 0) + 1
+        if highlight:
+            self.highlighted[group_id] = self.highlighted.get(group_id, 0) + 1
+
+    def mark_read(self, group_id):
+        self.unread.pop(group_id, None)
+        self.highlighted.pop(group_id, None)
+
+    def rank(self, group):
+        # Sort key, highest first: channels with highlights, then with unread
+        # messages, then by latest activity
+        group_id = group["id"]
+        return (
+            group_id in self.highlighted,
+            self.unread.get(group_id, 0) > 0,
+            self.last_activity.get(group_id, group.get("updated_at", 0)),
+        )
+
+    def likely_next(self, groups, exclude=None, count=PREFETCH_CHANNELS):
+        candidates = [
+            group
+            for group in groups
+            if group["id"] != exclude and not self.is_warm(group["id"])
+        ]
+        candidates.sort(key=self.rank, reverse=True)
+        return [group["id"] for group in candidates[:count]]
+
+
+class ChannelFilterIndex:
+    # Lookup over group names for the channel filter box, rebuilt only when
+    # the names change. Queries of one or two characters match the start of
+    # any word in a name; longer ones match anywhere, narrowed down to the
+    # names sharing all of the query's trigrams before the final check.
+    def __init__(self):
+        self.names = {}  # group_id -> casefolded name
+        self.prefixes = {}  # one or two character word prefix -> group_ids
+        self.trigrams = {}  # trigram -> group_ids
+
+    def rebuild(self, groups):
+        names = {group["id"]: (group.get("name") or "").casefold() for group in groups}
+        if names == self.names:
+            return
+        self.names = names
+        self.prefixes = {}
+        self.trigrams = {}
+        for group_id, name in names.items():
+            for word in name.split():
+                self.prefixes.setdefault(word[:1], set()).add(group_id)
+                if len(word) > 1:
+                    self.prefixes.setdefault(word[:2], set()).add(group_id)
+            for start in range(len(name) - 2):
+                self.trigrams.setdefault(name[start : start + 3], set()).add(group_id)
+
+    def search(self, query):
+        # The matching group ids, or None when there is nothing to filter by
+        query = query.strip().casefold()
+        if not query:
+            return None
+        if len(query) < 3:
+            return self.prefixes.get(query, set())
+        postings = sorted(
+            (
+                self.trigrams.get(query[start : start + 3], set())
+                for start in range(len(query) - 2)
+            ),
+            key=len,
+        )
+        candidates = postings[0].intersection(*postings[1:])
+        return {group_id for group_id in candidates if query in self.names[group_id]}
+
+
+class ChannelListView:
+    # Keeps a Listbox in step with a list of (group_id, label, color) rows,
+    # touching only rows that moved, appeared, went away or changed. A
+    # channel jumping to the top costs one delete and one insert, however
+    # many rows it passes.
+    def __init__(self, listbox):
+        self.listbox = listbox
+        self.rows = []  # As currently shown
+
+    def __len__(self):
+        return len(self.rows)
+
+    def group_at(self, index):
+        return self.rows[index][0]
+
+    def index_of(self, group_id):
+        for index, row in enumerate(self.rows):
+            if row[0] == group_id:
+                return index
+        return None
+
+    def update(self, rows):
+        wanted = {row[0] for row in rows}
+        for index in range(len(self.rows) - 1, -1, -1):
+            if self.rows[index][0] not in wanted:
+                self._delete(index)
+        for index, row in enumerate(rows):
+            current = self.rows[index] if index < len(self.rows) else None
+            if current is not None and current[0] == row[0]:
+                if current != row:
+                    self._delete(index)
+                    self._insert(index, row)
+                continue
+            following = self.rows[index + 1] if index + 1 < len(self.rows) else None
+            if following is not None and following[0] == row[0]:
+                # The row here moved down; it goes back in when we reach it
+                self._delete(index)
+                if following != row:
+                    self._delete(index)
+                    self._insert(index, row)
+                continue
+            # Moved up from further down, or new
+            for later in range(index + 1, len(self.rows)):
+                if self.rows[later][0] == row[0]:
+                    self._delete(later)
+                    break
+            self._insert(index, row)
+
+    def _insert(self, index, row):
+        self.listbox.insert(index, row[1])
+        if row[2]:
+            self.listbox.itemconfig(index, fg=row[2])
+        self.rows.insert(index, row)
+
+    def _delete(self, index):
+        self.listbox.delete(index)
+        del self.rows[index]
+
+
+class MemberIndex:
+    # A group's members as a user_id -> nickname dict plus the sort keys
+    # (casefolded nickname, user_id) in order, so a nickname prefix is a
+    # bisect away and a join or leave is a single insort or delete.
+    def __init__(self, members=()):
+        self.members = {}  # user_id -> nickname
+        self.keys = []  # sorted (casefolded nickname, user_id)
+        self.apply(members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def key(self, user_id):
+        return (self.members[user_id].casefold(), user_id)
+
+    def nickname(self, user_id):
+        return self.members[user_id]
+
+    def apply(self, members):
+        # Brings the index in line with a new roster and returns the user_ids
+        # that were added and the sort keys that went away. A rename shows up
+        # as both.
+        latest = {member["user_id"]: member.get("nickname") or "" for member in members}
+        added = [u for u, name in latest.items() if self.members.get(u) != name]
+        gone = [u for u, name in self.members.items() if latest.get(u) != name]
+        removed = [self.key(user_id) for user_id in gone]
+        if len(added) + len(removed) > len(latest) // 2:
+            # Mostly new (or the first roster): sorting once beats insorts
+            self.members = latest
+            self.keys = sorted(self.key(user_id) for user_id in latest)
+            return added, removed
+        for key in removed:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+            del self.members[key[1]]
+        for user_id in added:
+            self.members[user_id] = latest[user_id]
+            bisect.insort(self.keys, self.key(user_id))
+        return added, removed
+
+    def matching(self, prefix=""):
+        # Sort keys of the members whose nickname starts with prefix
+        prefix = prefix.strip().casefold()
+        if not prefix:
+            return list(self.keys)
+        low = bisect.bisect_left(self.keys, (prefix,))
+        high = bisect.bisect_left(self.keys, (prefix + "\U0010ffff",))
+        return self.keys[low:high]
+
+
+class MemberListView:
+    # The member pane of the open group, sorted by nickname and narrowed by
+    # a prefix filter. A new group is shown a screenful at a time: the rows
+    # in view go in at once and the rest follow in chunks between events, so
+    # a 2,000-member group never blocks the switch. A new roster for the
+    # same group only inserts and deletes the rows that changed.
+    def __init__(self, listbox, chunk=MEMBER_LIST_CHUNK):
+        self.listbox = listbox
+        self.chunk = chunk
+        self.line_height = font.Font(font=listbox.cget("font")).metrics("linespace")
+        self.group_id = None
+        self.index = MemberIndex()
+        self.prefix = ""
+        self.rows = []  # Sort keys of the rows to show, in order
+        self.filled = 0  # How many of them are in the listbox so far
+        self.job = None
+
+    def show(self, group_id, members):
+        if group_id == self.group_id and self.filled == len(self.rows):
+            self._apply(members)
+            return
+        self.group_id = group_id
+        self.index = MemberIndex(members)
+        self._refill()
+
+    def set_prefix(self, prefix):
+        self.prefix = prefix
+        self._refill()
+
+    def _apply(self, members):
+        added, removed = self.index.apply(members)
+        for key in removed:
+            position = bisect.bisect_left(self.rows, key)
+            if position < len(self.rows) and self.rows[position] == key:
+                del self.rows[position]
+                self.listbox.delete(position)
+        prefix = self.prefix.strip().casefold()
+        for user_id in added:
+            key = self.index.key(user_id)
+            if key[0].startswith(prefix):
+                position = bisect.bisect_left(self.rows, key)
+                self.rows.insert(position, key)
+                self.listbox.insert(position, self.index.nickname(user_id))
+        self.filled = len(self.rows)
+
+    def _refill(self):
+        if self.job is not None:
+            self.listbox.after_cancel(self.job)
+            self.job = None
+        self.listbox.delete(0, tk.END)
+        self.rows = self.index.matching(self.prefix)
+        self.filled = 0
+        # Enough rows to fill the pane first, the rest in the background
+        self._fill(self.listbox.winfo_height() // self.line_height + 1)
+
+    def _fill(self, count=None):
+        self.job = None
+        end = min(self.filled + (count or self.chunk), len(self.rows))
+        self.listbox.insert(
+            tk.END,
+            *(self.index.nickname(key[1]) for key in self.rows[self.filled : end]),
+        )
+        self.filled = end
+        if self.filled < len(self.rows):
+            self.job = self.listbox.after(1, self._fill)
+
+
+class MessageStore:
+    # Persistent per-group message history in SQLite, so a channel can be
+    # painted from disk before the network answers. Writes are batched on a
+    # background thread; reads use their own connection on the caller's thread.
+    # An FTS5 index over text and sender is kept up to date by a trigger, so
+    # it is maintained inside the writer's batches too.
+    #
+    # Push events for every group land here as well, so the newest stored
+    # row says nothing about what has actually been fetched. Each group
+    # therefore has a sync cursor: the (created_at, id) of the newest message
+    # of the last fetched page that connected to the group's history. Rows up
+    # to the cursor are painted as history; anything newer is left for the
+    # fetch that asks for messages after the cursor.
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.write_queue = Queue()
+        self.reader = None
+        self.cursors = {}  # group_id -> (created_at, id) fetched through
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.reader = self._connect()
+            self.cursors = {
+                group_id: (created_at, message_id)
+                for group_id, created_at, message_id in self.reader.execute(
+                    "SELECT group_id, created_at, id FROM sync_cursors"
+                )
+            }
+        except (OSError, sqlite3.Error) as e:
+            print(f"Message store unavailable at {path}: {e}")
+            return
+        threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id TEXT PRIMARY KEY, group_id TEXT NOT NULL, "
+            "created_at INTEGER NOT NULL, data TEXT NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS messages_group_created "
+            "ON messages (group_id, created_at)"
+        )
+        # Shares rowids with messages. Message text never changes, so only
+        # inserts need indexing; updates (e.g. new likes) are upserts that
+        # keep the rowid and do not fire the trigger.
+        connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+            "text, name, tokenize='unicode61 remove_diacritics 2')"
+        )
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS messages_search_insert "
+            "AFTER INSERT ON messages BEGIN "
+            "INSERT INTO message_search (rowid, text, name) VALUES (new.rowid, "
+            "coalesce(json_extract(new.data, '$.text'), ''), "
+            "coalesce(json_extract(new.data, '$.name'), '')); END"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sync_cursors ("
+            "group_id TEXT PRIMARY KEY, created_at INTEGER NOT NULL, id TEXT NOT NULL)"
+        )
+        return connection
+
+    def _migrate(self, connection):
+        # Stores written before the search index existed need a backfill
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        with connection:
+            connection.execute("DELETE FROM message_search")
+            connection.execute(
+                "INSERT INTO message_search (rowid, text, name) SELECT rowid, "
+                "coalesce(json_extract(data, '$.text'), ''), "
+                "coalesce(json_extract(data, '$.name'), '') FROM messages"
+            )
+            connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def save(self, messages):
+        if self.reader is not None and messages:
+            self.write_queue.put(("messages", list(messages)))
+
+    def cursor(self, group_id):
+        return self.cursors.get(group_id)
+
+    def advance_cursor(self, group_id, messages, since_id=None):
+        # Called with every fetched page of a group's newest messages. A page
+        # fetched without since_id is the group's tail, and so is a full
+        # page; a shorter since_id page only continues the history if it
+        # picks up right at the cursor.
+        if not messages:
+            return
+        cursor = self.cursors.get(group_id)
+        if since_id and len(messages) < MESSAGE_PAGE_SIZE:
+            if cursor is None or cursor[1] != since_id:
+                return
+        newest = max(MessageRecord.of(m).key for m in messages)
+        if cursor is not None and newest <= cursor:
+            return
+        self.cursors[group_id] = newest
+        if self.reader is not None:
+            self.write_queue.put(("cursor", (group_id, *newest)))
+
+    def _write_loop(self):
+        connection = self._connect()
+        try:
+            self._migrate(connection)
+        except sqlite3.Error as e:
+            print(f"Failed to build the search index: {e}")
+        while True:
+            # Coalesce everything queued so far into a single transaction
+            batch = [self.write_queue.get()]
+            try:
+                while True:
+                    batch.append(self.write_queue.get_nowait())
+            except Empty:
+                pass
+            rows = []
+            cursors = {}
+            for kind, payload in batch:
+                if kind == "cursor":
+                    cursors[payload[0]] = payload
+                    continue
+                rows.extend(
+                    (m["id"], m["group_id"], m.get("created_at", 0), json.dumps(m))
+                    for m in payload
+                    if m.get("id") and m.get("group_id")
+                )
+            try:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO messages VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (id) DO UPDATE SET "
+                        "created_at = excluded.created_at, data = excluded.data",
+                        rows,
+                    )
+                    # After the messages, so a cursor never points past them
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO sync_cursors VALUES (?, ?, ?)",
+                        cursors.values(),
+                    )
+            except sqlite3.Error as e:
+                print(f"Failed to write {len(rows)} messages to the store: {e}")
+
+    def latest(self, group_id, limit=20):
+        # The newest fetched history, up to the group's cursor, newest first
+        # (the same order the backend returns them in)
+        cursor = self.cursors.get(group_id)
+        if self.reader is None or cursor is None:
+            return []
+        try:
+            rows = self.reader.execute(
+                "SELECT data FROM messages WHERE group_id = ? "
+                "AND (created_at, id) <= (?, ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (group_id, *cursor, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Failed to read messages for group {group_id}: {e}")
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+    def around(self, group_id, message_id, before=20, after=20):
+        # The stored messages either side of message_id, oldest first
+        if self.reader is None:
+            return []
+        try:
+            row = self.reader.execute(
+                "SELECT created_at FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+            if row is None:
+                return []
+            key = (row[0], message_id)
+            older = self.reader.execute(
+                "SELECT data FROM messages WHERE group_id = ? "
+                "AND (created_at, id) < (?, ?) "
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                (group_id, *key, before),
+            ).fetchall()
+            newer = self.reader.execute(
+                "SELECT data FROM messages WHERE group_id = ? "
+                "AND (created_at, id) >= (?, ?) "
+                "ORDER BY created_at, id LIMIT ?",
+                (group_id, *key, after + 1),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Failed to read messages around {message_id}: {e}")
+            return []
+        return [json.loads(row[0]) for row in reversed(older)] + [
+            json.loads(row[0]) for row in newer
+        ]
+
+    @staticmethod
+    def search_terms(query):
+        return re.findall(r"\w+", query)
+
+    def search(self, query, group_id=None, limit=100):
+        # Newest matches first. Every word must match, as a prefix, so the
+        # query never needs FTS5 syntax.
+        terms = self.search_terms(query)
+        if self.reader is None or not terms:
+            return []
+        match = " ".join(f'"{term}"*' for term in terms)
+        sql = (
+            "SELECT m.data FROM message_search s JOIN messages m "
+            "ON m.rowid = s.rowid WHERE message_search MATCH ?"
+        )
+        params = [match]
+        if group_id is not None:
+            sql += " AND m.group_id = ?"
+            params.append(group_id)
+        sql += " ORDER BY m.created_at DESC LIMIT ?"
+        params.append(limit)
+        try:
+            rows = self.reader.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            print(f"Search for {query!r} failed: {e}")
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+
+class ChatHistoryIndex:
+    # Every message known for the open channel, in order, and the window of
+    # them that is currently materialized in the chat_history Text widget.
+    # Rendered messages are delimited by Text marks, so a refresh only has to
+    # patch what actually changed, and the window can slide over a long
+    # history without the widget ever holding all of it.
+    def __init__(self):
+        self.messages = {}  # message_id -> latest MessageRecord for that message
+        self.order = []  # (created_at, message_id), sorted oldest first
+        self.lo = 0  # order[lo:hi] is rendered
+        self.hi = 0
+        self.bytes = 0
+
+    def __contains__(self, message_id):
+        return message_id in self.messages
+
+    def __len__(self):
+        return len(self.order)
+
+    @staticmethod
+    def start_mark(message_id):
+        return f"msg-{message_id}"
+
+    @staticmethod
+    def likes_marks(message_id):
+        return f"likes-{message_id}", f"likes-end-{message_id}"
+
+    @classmethod
+    def marks_for(cls, message_ids):
+        for message_id in message_ids:
+            yield cls.start_mark(message_id)
+            yield from cls.likes_marks(message_id)
+
+    def clear(self):
+        self.messages.clear()
+        self.order.clear()
+        self.lo = self.hi = 0
+        self.bytes = 0
+
+    def position(self, message_id):
+        return bisect.bisect_left(self.order, self.messages[message_id].key)
+
+    def is_rendered(self, message_id):
+        return (
+            message_id in self.messages
+            and self.lo <= self.position(message_id) < self.hi
+        )
+
+    def rendered_ids(self):
+        return [message_id for _, message_id in self.order[self.lo : self.hi]]
+
+    def rendered_count(self):
+        return self.hi - self.lo
+
+    def at_tail(self):
+        return self.hi == len(self.order)
+
+    def get(self, message_id):
+        return self.messages.get(message_id)
+
+    def add(self, message):
+        # Returns whether the message falls inside the rendered window and, if
+        # so, the id of the rendered message it must be inserted in front of
+        # (None means at the end).
+        position = bisect.bisect(self.order, message.key)
+        was_at_tail = self.at_tail()
+        self.order.insert(position, message.key)
+        self.messages[message.id] = message
+        self.bytes += message.nbytes()
+        if self.lo > 0 and position <= self.lo:
+            # Older than anything rendered: it will show up when scrolled to
+            self.lo += 1
+            self.hi += 1
+            return False, None
+        if position < self.hi or was_at_tail:
+            self.hi += 1
+            if position + 1 < self.hi:
+                return True, self.order[position + 1][1]
+            return True, None
+        return False, None  # Newer than the window, which is not at the tail
+
+    def update(self, message):
+        previous = self.messages.get(message.id)
+        if previous is not None:
+            self.bytes -= previous.nbytes()
+        self.messages[message.id] = message
+        self.bytes += message.nbytes()
+
+    # MemoryBudget consumer interface. The open channel's model is counted
+    # but never evicted; it goes when the channel is closed.
+
+    def memory_usage(self):
+        return self.bytes
+
+    def oldest_view(self):
+        return None
+
+    def evict_oldest(self):
+        return 0
+
+    def newest_id(self):
+        return self.order[-1][1] if self.order else None
+
+    def tail(self, count):
+        # The newest `count` messages, oldest first
+        return [self.messages[message_id] for _, message_id in self.order[-count:]]
+
+    def oldest_id(self):
+        return self.order[0][1] if self.order else None
+
+    def extend_up(self, count):
+        # Materialize up to `count` older messages; returns their ids, oldest
+        # first, and the id of the rendered message they go in front of.
+        next_id = self.order[self.lo][1] if self.lo < self.hi else None
+        start = max(0, self.lo - count)
+        ids = [message_id for _, message_id in self.order[start : self.lo]]
+        self.lo = start
+        return ids, next_id
+
+    def extend_down(self, count):
+        end = min(len(self.order), self.hi + count)
+        ids = [message_id for _, message_id in self.order[self.hi : end]]
+        self.hi = end
+        return ids
+
+    def shrink_top(self, count):
+        end = min(self.hi, self.lo + count)
+        ids = [message_id for _, message_id in self.order[self.lo : end]]
+        self.lo = end
+        return ids
+
+    def shrink_bottom(self, count):
+        start = max(self.lo, self.hi - count)
+        ids = [message_id for _, message_id in self.order[start : self.hi]]
+        self.hi = start
+        return ids
+
+    def recenter(self, message_id, radius):
+        # Make the window the `radius` messages either side of message_id and
+        # return every id in it, oldest first.
+        position = self.position(message_id)
+        self.lo = max(0, position - radius)
+        self.hi = min(len(self.order), position + radius + 1)
+        return self.rendered_ids()
+
+    def diff(self, messages):
+        # Returns the messages we have not seen yet (oldest first) and the
+        # known messages whose likes changed.
+        new_messages = []
+        changed_likes = []
+        for message in map(MessageRecord.of, messages):
+            known = self.messages.get(message.id)
+            if known is None:
+                new_messages.append(message)
+            elif known.favorited_by != message.favorited_by:
+                changed_likes.append(message)
+        new_messages.sort(key=lambda m: m.key)
+        return new_messages, changed_likes
+
+
 class HexChatUI(tk.Frame):
     def __init__(self, master=None):
         super().__init__(master)
@@ -139,17 +2233,69 @@ class HexChatUI(tk.Frame):
         self.current_nickname_in_group = None
         self.current_channel_name = ""  # Default channel name
         self.current_user_id = None
-        self.current_members = []
-        self.chat_history_image_references = []  # To prevent images from being garbage collected
+        self.current_user = None
+        self.access_token = None
+        self.bootstrap_results = {}  # Responses waiting on the /token answer
+        self.groups_fetched = False  # self.groups may still be the snapshot's
+        self.snapshot_channel_pending = False  # Painted, waiting on fresh groups
+        self.snapshot_job = None
+        self.roster = RosterCache()
+        self.chat_history_image_references = {}  # To prevent images from being garbage collected
         self.message_queue = Queue()
+        self.sound_player = SoundPlayer(SOUNDS_DIR)
+        self.muted_channels = self.load_muted_channels()
+        self.highlighter = HighlightEngine(*self.load_highlight_rules())
+        self.channel_buffers = ChannelBuffers()
+        self.channel_synced = False  # history_index holds the channel's tail
+        self.search_context = False  # history_index holds a search hit's surroundings
+        self.prefetch_job = None
+        self.prefetching = set()  # group_ids with a prefetch in flight
+        self.drain_pending = threading.Event()
+        self.in_chat_transaction = False
         self.groupme_push_client = None  # Will be initialized after fetching user ID
         self.polling_job = None
         self.is_polling = False
-        self.displayed_message_ids = set()
-        self.messages_cache = []
+        self.backend = BackendClient(self)
+        self.outbox = Outbox(
+            self.backend, self, self.on_outbox_change, self.on_outbox_sent
+        )
+        self.pending_lines = {}  # guid -> True, in chat_history order
+        self.poll_request = None
+        self.poll_interval = PollInterval()
+        self.likes_job = None
+        self.window_visible = True
+        self.history_index = ChatHistoryIndex()
+        self.image_loader = ImageLoader(
+            self,
+            cache_bytes=MEMORY_BUDGET,  # Trimmed further by memory_budget
+            disk_cache=DiskCache(os.path.join(CACHE_DIR, "images")),
+        )
+        self.image_marks = {}  # message_id -> placeholder mark of a loading image
+        self.link_index = {}  # message_id -> [(start, end, url)] offsets from msg-<id>
+        self.window_update_job = None
+        self.reset_older_history()
+        self.last_page = None  # Ids and likes of the last full page fetched
+        self.message_store = MessageStore(os.path.join(CACHE_DIR, "messages.sqlite3"))
+        self.memory_budget = MemoryBudget()
+        self.memory_budget.register("images", self.image_loader.cache)
+        self.memory_budget.register("channel buffers", self.channel_buffers)
+        self.memory_budget.register("open channel", self.history_index)
         self.create_widgets()
-        self.after(100, self.process_message_queue)  # Start processing queue
-        self.show_login_view()
+        self.animation_ticker = AnimationTicker(self.chat_history)
+        self.master.bind("<Unmap>", self.on_window_unmap, add="+")
+        self.master.bind("<Map>", self.on_window_map, add="+")
+        self.master.bind("<F12>", self.toggle_debug_panel, add="+")
+        self.master.bind("<Control-f>", self.open_search_panel, add="+")
+        self.debug_panel = None
+        self.search_panel = None
+        self.search_results = []
+        self.search_terms = []
+        self.pending_search_jump = None  # Result waiting for its channel to load
+        self.debug_panel_job = None
+        self.lag_job = None
+        if METRICS.enabled:
+            self.schedule_lag_check()
+        self.bootstrap()
 
     def create_widgets(self):
         # Main frame
@@ -188,6 +2334,28 @@ class HexChatUI(tk.Frame):
             font=("Courier", 14, "bold"),
         )
         channel_list_label.pack(pady=5, padx=5, anchor="w")
+        # Type to filter the channel list; Enter opens the top match
+        self.channel_filter_var = tk.StringVar(channel_list_frame)
+        self.channel_filter_var.trace_add(
+            "write", lambda *args: self.refresh_channel_list()
+        )
+        self.channel_filter_entry = tk.Entry(
+            channel_list_frame,
+            textvariable=self.channel_filter_var,
+            bg="#2a2a2a",
+            fg="white",
+            insertbackground="white",
+            font=("Courier", 12),
+            borderwidth=0,
+            highlightthickness=1,
+            highlightcolor="#555555",
+            highlightbackground="#444444",
+        )
+        self.channel_filter_entry.pack(fill=tk.X, padx=5, pady=(0, 5))
+        self.channel_filter_entry.bind("<Return>", self.open_first_channel)
+        self.channel_filter_entry.bind(
+            "<Escape>", lambda event: self.channel_filter_var.set("")
+        )
         self.channel_list = tk.Listbox(
             channel_list_frame,
             bg="#3c3c3c",
@@ -197,9 +2365,13 @@ class HexChatUI(tk.Frame):
             highlightthickness=0,
             borderwidth=0,
             font=("Courier", 12),
+            exportselection=False,  # Keep the open channel selected while typing
         )
         self.channel_list.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
         self.channel_list.bind("<<ListboxSelect>>", self.on_channel_select)
+        self.channel_list.bind("<Button-3>", self.on_channel_context_menu)
+        self.channel_rows = ChannelListView(self.channel_list)
+        self.channel_index = ChannelFilterIndex()
         self.main_paned_window.add(channel_list_frame, weight=0)
 
         # Create a new paned window for the chat and user list.
@@ -242,11 +2414,62 @@ class HexChatUI(tk.Frame):
             font=("Courier", 12),
             borderwidth=0,
             highlightthickness=0,
+            yscrollcommand=self.on_chat_scroll,
         )
         self.chat_history.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
+        # The tag set is fixed, so configure and bind it once up front rather
+        # than on every insert. Links share one "hyperlink" tag and resolve
+        # their URL through link_index when clicked.
+        self.chat_user_font = font.Font(
+            self.chat_history, self.chat_history.cget("font")
+        )
+        self.chat_user_font.configure(weight="bold")
+        self.chat_history.tag_configure(
+            "user_tag", font=self.chat_user_font, foreground="#87ceeb"
+        )
+        self.chat_history.tag_configure("timestamp", foreground="#a9a9a9")
+        self.chat_history.tag_configure(
+            "hyperlink", foreground="#00BFFF", underline=True
+        )
+        self.chat_history.tag_configure("like_message", foreground="#ff69b4")
+        self.chat_history.tag_configure("image_placeholder", foreground="#a9a9a9")
+        self.chat_history.tag_configure(
+            "highlight", foreground="#ffd27f", background="#4a3b00"
+        )
+        self.chat_history.tag_configure("search_hit", background="#2f3f5f")
+        self.chat_history.tag_configure("search_match", background="#6b5a00")
+        # Configured last so it greys out the other tags of unsent messages
+        self.chat_history.tag_configure("pending", foreground="#777777")
+        self.chat_history.tag_bind("hyperlink", "<Button-1>", self.on_hyperlink_click)
+        self.chat_history.tag_bind("unsent", "<Button-1>", self.on_unsent_click)
+        self.chat_history.tag_bind("unsent", "<Enter>", self.on_hyperlink_enter)
+        self.chat_history.tag_bind("unsent", "<Leave>", self.on_hyperlink_leave)
+        self.chat_history.tag_bind("hyperlink", "<Enter>", self.on_hyperlink_enter)
+        self.chat_history.tag_bind("hyperlink", "<Leave>", self.on_hyperlink_leave)
+
         # User list (right pane)
         user_list_frame = tk.Frame(chat_user_paned_window, bg="#1e1e1e")
+        # Type the start of a nickname to narrow the member list
+        self.user_filter_var = tk.StringVar(user_list_frame)
+        self.user_filter_var.trace_add(
+            "write",
+            lambda *args: self.member_list.set_prefix(self.user_filter_var.get()),
+        )
+        user_filter_entry = tk.Entry(
+            user_list_frame,
+            textvariable=self.user_filter_var,
+            bg="#2a2a2a",
+            fg="white",
+            insertbackground="white",
+            font=("Courier", 12),
+            borderwidth=0,
+            highlightthickness=1,
+            highlightcolor="#555555",
+            highlightbackground="#444444",
+        )
+        user_filter_entry.pack(fill=tk.X, padx=5, pady=(5, 0))
+        user_filter_entry.bind("<Escape>", lambda event: self.user_filter_var.set(""))
         self.user_list = tk.Listbox(
             user_list_frame,
             bg="#1e1e1e",
@@ -254,8 +2477,10 @@ class HexChatUI(tk.Frame):
             highlightthickness=0,
             borderwidth=0,
             font=("Courier", 12),
+            exportselection=False,
         )
         self.user_list.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.member_list = MemberListView(self.user_list)
         chat_user_paned_window.add(user_list_frame, weight=0)
 
         # User info and input field
@@ -320,55 +2545,193 @@ class HexChatUI(tk.Frame):
         auth_url = f"https://oauth.groupme.com/oauth/authorize?client_id={client_id}"
         webbrowser.open_new(auth_url)
 
+    def bootstrap(self):
+        # Paint the last session right away, and ask for the token, the user
+        # and the groups all at once instead of one after the other
+        snapshot = self.load_snapshot()
+        if snapshot:
+            self.paint_snapshot(snapshot)
+        else:
+            self.show_login_view()
+        self.check_auth_status()
+        self.backend.get(
+            "/user/me",
+            callback=lambda user: self.on_bootstrap_result("user", user),
+            errback=lambda e: self.on_bootstrap_error("user", e),
+        )
+        self.backend.get(
+            "/groups",
+            callback=lambda groups: self.on_bootstrap_result("groups", groups),
+            errback=lambda e: self.on_bootstrap_error("groups", e),
+        )
+
+    def on_bootstrap_result(self, key, data):
+        if self.bootstrap_results is None:
+            return  # Fetched while logged out, so of no use
+        self.bootstrap_results[key] = data
+        self.apply_bootstrap_results()
+
+    def on_bootstrap_error(self, key, error):
+        print(f"Bootstrap: error fetching {key}: {error}")
+        # Recorded as None so it is fetched again once we know we're logged in
+        self.on_bootstrap_result(key, None)
+
+    def apply_bootstrap_results(self):
+        # Only trust the early answers once /token says we were logged in.
+        # Anything that failed (or came back blank, as /user/me does when
+        # GroupMe fails) is fetched again now; anything still in flight is
+        # applied when it arrives.
+        if not self.access_token or self.bootstrap_results is None:
+            return
+        if "user" in self.bootstrap_results:
+            user = self.bootstrap_results.pop("user")
+            if user and user.get("id"):
+                self.on_current_user(user)
+            else:
+                self.fetch_current_user()
+        if "groups" in self.bootstrap_results:
+            groups = self.bootstrap_results.pop("groups")
+            if groups is not None:
+                self.on_groups(groups)
+            else:
+                self.fetch_groups()
+
     def show_login_view(self):
         self.main_paned_window.pack_forget()
         self.bottom_frame.pack_forget()
         self.login_frame.pack(fill=tk.BOTH, expand=True)
-        self.check_auth_status()
 
     def check_auth_status(self):
-        try:
-            response = requests.get("http://127.0.0.1:3000/token")
-            response.raise_for_status()
-            token_data = response.json()
-            if token_data.get("token"):
-                self.show_main_view()
-                return
-        except requests.exceptions.RequestException:
-            pass  # Ignore connection errors, we'll retry
-        self.after(1000, self.check_auth_status)
+        self.backend.get(
+            "/token",
+            callback=self.on_auth_status,
+            # Ignore connection errors, we'll retry
+            errback=lambda e: self.after(1000, self.check_auth_status),
+        )
+
+    def on_auth_status(self, token_data):
+        token = token_data.get("token")
+        if not token:
+            # The user and groups fetched alongside are for nobody; fetch
+            # them again once the user has logged in
+            self.bootstrap_results = None
+            self.show_login_view()
+            self.after(1000, self.check_auth_status)
+            return
+        self.access_token = token
+        self.show_main_view()
+        if self.bootstrap_results is not None:
+            self.apply_bootstrap_results()
+        else:
+            self.fetch_current_user()
+            self.fetch_groups()
 
     def show_main_view(self):
         self.login_frame.pack_forget()
         self.main_paned_window.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
         self.bottom_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(5, 0))
-        self.fetch_current_user()
-        self.fetch_groups()
-        self.after(200, self.start_faye_client)
 
     def fetch_current_user(self):
+        self.backend.get(
+            "/user/me",
+            callback=self.on_current_user,
+            errback=lambda e: self.add_message(
+                "System", f"Error fetching current user: {e}"
+            ),
+        )
+
+    def on_current_user(self, user_data):
+        if not user_data.get("id"):
+            # The backend answers with a blank user when GroupMe fails
+            print("Backend returned no current user.")
+            return
+        self.current_user = user_data
+        self.current_username = user_data.get("name", "User1")
+        self.current_user_id = user_data.get("id")
+        self.user_info_label.config(text=self.current_username)
+        if self.current_group_id:
+            self.current_nickname_in_group = self.roster.nickname(
+                self.current_group_id, self.current_user_id, self.current_username
+            )
+        self.update_highlight_identity()
+        self.update_window_title()
+        self.schedule_snapshot()
+
+        # Initialize GroupMePushClient once we know the user ID, reusing the
+        # token we already have
+        if self.current_user_id and not self.groupme_push_client:
+            self.groupme_push_client = GroupMePushClient(
+                self.access_token,
+                self.current_user_id,
+                self.message_queue,
+                self.update_online_indicator,
+                self.notify_message_queue,
+            )
+            self.start_faye_client()
+
+    def load_snapshot(self):
         try:
-            response = requests.get("http://127.0.0.1:3000/user/me")
-            response.raise_for_status()
-            user_data = response.json()
-            self.current_username = user_data.get("name", "User1")
-            self.current_user_id = user_data.get("id")
-            self.user_info_label.config(text=self.current_username)
-            self.update_window_title()
-
-            # Initialize GroupMePushClient after fetching user ID, but don't start it yet
-            if self.current_user_id and not self.groupme_push_client:
-                token_response = requests.get("http://127.0.0.1:3000/token")
-                token_response.raise_for_status()
-                access_token = token_response.json().get("token")
-                self.groupme_push_client = GroupMePushClient(
-                    access_token,
-                    self.current_user_id,
-                    self.message_queue,
-                    self.update_online_indicator,
-                )
-        except requests.exceptions.RequestException as e:
-            self.add_message("System", f"Error fetching current user: {e}")
+            with open(os.path.join(CACHE_DIR, "snapshot.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def paint_snapshot(self, snapshot):
+        # Show the channel list and open channel as they were last session.
+        # Nothing here touches the network; the bootstrap requests catch up.
+        user = snapshot.get("user") or {}
+        self.current_username = user.get("name", self.current_username)
+        self.user_info_label.config(text=self.current_username)
+        self.groups = snapshot.get("groups") or []
+        self.roster.update(self.groups)
+        self.update_highlight_identity()
+        self.roster.invalidate()  # Names to render with, but not to be trusted
+        self.show_main_view()
+
+        group = self.roster.get(snapshot.get("current_group_id"))
+        if group:
+            self.current_group_id = group["id"]
+            self.current_channel_name = group["name"]
+            self.update_user_list(group["members"])
+            self.update_channel_description_entry(group.get("description", ""))
+            self.snapshot_channel_pending = True
+        self.update_channel_list()
+        if group:
+            cached_messages = self.message_store.latest(group["id"])
+            if cached_messages:
+                with self.chat_transaction(follow=True):
+                    self.reconcile_messages(cached_messages)
+        self.update_window_title()
+
+    def schedule_snapshot(self):
+        if self.snapshot_job is None:
+            self.snapshot_job = self.after(1000, self.save_snapshot)
+
+    def save_snapshot(self):
+        self.snapshot_job = None
+        if not self.groups_fetched:
+            return  # Nothing newer than what is on disk
+        snapshot = {
+            "user": self.current_user,
+            "groups": self.groups,
+            "current_group_id": self.current_group_id,
+        }
+        # The groups list is replaced on refresh, never mutated, so the
+        # writer thread can serialize it without a copy
+        threading.Thread(
+            target=self.write_snapshot, args=(snapshot,), daemon=True
+        ).start()
+
+    @staticmethod
+    def write_snapshot(snapshot):
+        path = os.path.join(CACHE_DIR, "snapshot.json")
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Could not save the session snapshot: {e}")
 
     def update_window_title(self):
         title = f"GxChat: {self.current_username}"
@@ -377,101 +2740,271 @@ class HexChatUI(tk.Frame):
         self.master.title(title)
 
     def fetch_groups(self):
-        self.fetch_current_user()  # Fetch user info when refreshing groups
-        try:
-            response = requests.get("http://127.0.0.1:3000/groups")
-            response.raise_for_status()
-            self.groups = response.json()
-            self.update_channel_list()
-        except requests.exceptions.RequestException as e:
-            self.add_message("System", f"Error fetching groups: {e}")
+        self.backend.get(
+            "/groups",
+            callback=self.on_groups,
+            errback=lambda e: self.add_message("System", f"Error fetching groups: {e}"),
+        )
+
+    def on_groups(self, groups):
+        self.groups = groups
+        self.groups_fetched = True
+        self.roster.update(groups)
+        self.update_highlight_identity()
+        self.update_channel_list()
+        self.schedule_snapshot()
+        if self.snapshot_channel_pending:
+            # The snapshot's channel is painted; now load it for real
+            self.snapshot_channel_pending = False
+            group = self.roster.get(self.current_group_id)
+            if group:
+                self.show_channel(group)
+            else:
+                self.current_group_id = None  # Gone since last session
+                self.clear_chat_history()
+                self.update_channel_list()
+
+    def channel_label(self, group):
+        label = f"#{group['name']}"
+        unread = self.channel_buffers.unread.get(group["id"])
+        if unread:
+            label += f" ({unread})"
+        highlighted = self.channel_buffers.highlighted.get(group["id"])
+        if highlighted:
+            label += f" [@{highlighted}]"
+        return label
+
+    def channel_color(self, group_id):
+        if group_id in self.muted_channels:
+            return "#777777"
+        if group_id in self.channel_buffers.highlighted:
+            return "#ffa500"
+        return None
 
     def update_channel_list(self):
-        self.channel_list.delete(0, tk.END)
-        for group in self.groups:
-            self.channel_list.insert(tk.END, f"#{group['name']}")
-        if self.groups and not self.current_group_id:
-            self.channel_list.selection_set(0)  # Select the first item
-            self.on_channel_select(None)  # Manually trigger the selection handler
+        # The set of groups changed: re-index their names, then bring the
+        # Listbox in line
+        self.channel_index.rebuild(self.groups)
+        self.refresh_channel_list()
+        if not self.current_group_id and self.groups and self.groups_fetched:
+            self.open_first_channel()
+
+    @METRICS.timed("refresh_channel_list")
+    def refresh_channel_list(self):
+        # Most active first, narrowed by the filter box. Only rows whose
+        # position, badge or color changed are redrawn.
+        matches = self.channel_index.search(self.channel_filter_var.get())
+        groups = [
+            group for group in self.groups if matches is None or group["id"] in matches
+        ]
+        groups.sort(key=self.channel_buffers.rank, reverse=True)
+        self.channel_rows.update(
+            [
+                (
+                    group["id"],
+                    self.channel_label(group),
+                    self.channel_color(group["id"]),
+                )
+                for group in groups
+            ]
+        )
+        index = self.channel_rows.index_of(self.current_group_id)
+        if index is not None and not self.channel_list.selection_includes(index):
+            self.channel_list.selection_clear(0, tk.END)
+            self.channel_list.selection_set(index)
+
+    def open_first_channel(self, event=None):
+        if len(self.channel_rows):
+            self.select_channel(self.channel_rows.group_at(0))
+
+    def select_channel(self, group_id):
+        # Opens a channel as if its row had been clicked, clearing the filter
+        # if it hides the row. Returns False if there is no such channel.
+        if self.channel_rows.index_of(group_id) is None:
+            self.channel_filter_var.set("")
+        index = self.channel_rows.index_of(group_id)
+        if index is None:
+            return False
+        self.channel_list.selection_clear(0, tk.END)
+        self.channel_list.selection_set(index)
+        self.channel_list.see(index)
+        self.on_channel_select(None)
+        return True
 
     def on_channel_select(self, event):
-        self.stop_polling()  # Stop polling for the old channel
         selection = self.channel_list.curselection()
-        if selection:
-            index = selection[0]
-            group_id = self.groups[index][
-                "id"
-            ]  # Get ID from current (possibly stale) list
-
-            # Clear previous channel state
-            self.chat_history.config(state=tk.NORMAL)
-            self.chat_history.delete(1.0, tk.END)
-            self.chat_history.config(state=tk.DISABLED)
-            self.chat_history_image_references.clear()
-            self.displayed_message_ids.clear()
-            self.messages_cache.clear()
+        if not selection:
+            return  # e.g. the open channel's row was filtered out
+        if event is not None and (
+            self.channel_rows.group_at(selection[0]) == self.current_group_id
+        ):
+            return  # Already open, or its row was just redrawn
+        self.stop_polling()  # Stop polling for the old channel
+        self.backend.cancel("channel")  # Drop responses meant for the old channel
+        if self.channel_synced:
+            # Keep the tail of the channel we are leaving warm in memory
+            self.channel_buffers.seed(
+                self.current_group_id,
+                self.history_index.tail(CHANNEL_BUFFER_SIZE),
+            )
+        group_id = self.channel_rows.group_at(selection[0])
 
-            try:
-                # Fetch the latest list of all groups to get fresh member data
-                response = requests.get("http://127.0.0.1:3000/groups")
-                response.raise_for_status()
-                all_groups = response.json()
-                self.groups = all_groups  # Update the stored list of groups
-
-                # Find the selected group in the fresh list
-                group = next((g for g in all_groups if g["id"] == group_id), None)
-
-                if group:
-                    self.current_group_id = group["id"]
-                    self.current_channel_name = group["name"]
-                    self.current_members = group["members"]
-
-                    # Find and set the user's nickname for the current group
-                    self.current_nickname_in_group = self.current_username
-                    for member in self.current_members:
-                        if member.get("user_id") == self.current_user_id:
-                            self.current_nickname_in_group = member.get("nickname")
-                            break
-
-                    self.update_user_list(group["members"])
-                    self.fetch_messages(self.current_group_id, initial_load=True)
-                    self.update_window_title()
-                    self.update_channel_description_entry(group.get("description", ""))
-
-                    # Ensure push client is running
-                    if (
-                        self.groupme_push_client
-                        and not self.groupme_push_client.running
-                    ):
-                        self.groupme_push_client.start()
-
-                    self.start_polling()  # Start polling for the new channel
-                else:
-                    self.add_message(
-                        "System",
-                        f"Could not find details for group {group_id} after refresh.",
-                    )
+        # Clear previous channel state
+        self.current_group_id = group_id
+        self.snapshot_channel_pending = False
+        self.schedule_snapshot()
+        self.channel_synced = False
+        self.search_context = False
+        self.clear_chat_history()
+        self.last_page = None
+        self.reset_older_history()
+        self.channel_buffers.mark_read(group_id)
+        self.channel_buffers.viewed(group_id)
+        self.refresh_channel_list()
+
+        warm = self.paint_cached_channel(group_id)
+        if self.roster.is_fresh(group_id):
+            self.show_channel(self.roster.get(group_id), fetch=not warm)
+            return
+
+        # Fetch the latest list of all groups to get fresh member data
+        self.backend.get(
+            "/groups",
+            callback=lambda all_groups: self.on_channel_groups(group_id, all_groups),
+            errback=lambda e: self.add_message(
+                "System", f"Error fetching group list: {e}"
+            ),
+            tag="channel",
+        )
+
+    def paint_cached_channel(self, group_id):
+        # A warm buffer is already up to date, so it needs no requests.
+        # Otherwise paint whatever we have on disk right away and let the
+        # network catch up. Returns whether the buffer was warm.
+        warm = self.channel_buffers.is_warm(group_id)
+        if warm:
+            cached_messages = self.channel_buffers.messages(group_id)
+        else:
+            cached_messages = self.message_store.latest(group_id)
+        if cached_messages:
+            with self.chat_transaction(follow=True):
+                self.reconcile_messages(cached_messages)
+        return warm
 
-            except requests.exceptions.RequestException as e:
-                self.add_message("System", f"Error fetching group list: {e}")
+    def on_channel_groups(self, group_id, all_groups):
+        self.groups = all_groups  # Update the stored list of groups
+        self.roster.update(all_groups)
+        self.update_highlight_identity()
+        self.update_channel_list()
+
+        group = self.roster.get(group_id)
+        if group:
+            self.show_channel(group, fetch=not self.channel_buffers.is_warm(group_id))
+        else:
+            self.add_message(
+                "System",
+                f"Could not find details for group {group_id} after refresh.",
+            )
+
+    def show_channel(self, group, fetch=True):
+        self.current_group_id = group["id"]
+        self.current_channel_name = group["name"]
+
+        # Find and set the user's nickname for the current group
+        self.current_nickname_in_group = self.roster.nickname(
+            group["id"], self.current_user_id, default=self.current_username
+        )
+
+        self.update_user_list(group["members"])
+        if fetch:
+            # Only ask for what is newer than the history painted from disk
+            cursor = self.message_store.cursor(group["id"])
+            self.fetch_messages(
+                self.current_group_id,
+                initial_load=True,
+                since_id=cursor[1] if cursor else None,
+            )
+        else:
+            self.channel_synced = True  # Painted from a warm buffer
+            self.schedule_prefetch()
+            if self.pending_search_jump:
+                self.after_idle(self.complete_pending_search_jump)
+        self.update_window_title()
+        self.update_channel_description_entry(group.get("description", ""))
+
+        # Ensure push client is running
+        if self.groupme_push_client and not self.groupme_push_client.running:
+            self.groupme_push_client.start()
+
+        self.start_polling()  # Start polling for the new channel
 
     def start_polling(self):
         if not self.is_polling and self.current_group_id:
             self.is_polling = True
-            self.poll_messages()
+            self.poll_interval.reset()
+            # The channel was just loaded, so the first poll can wait
+            self.schedule_poll()
+            self.likes_job = self.after(LIKES_POLL_INTERVAL * 1000, self.poll_likes)
 
     def stop_polling(self):
         if self.polling_job:
             self.after_cancel(self.polling_job)
             self.polling_job = None
+        if self.likes_job:
+            self.after_cancel(self.likes_job)
+            self.likes_job = None
         self.is_polling = False
 
+    def schedule_poll(self):
+        if self.polling_job:
+            self.after_cancel(self.polling_job)
+        self.polling_job = self.after(
+            self.poll_interval.next_delay_ms(), self.poll_messages
+        )
+
     def poll_messages(self):
-        if self.is_polling and self.current_group_id:
-            self.fetch_messages(self.current_group_id)
-            self.polling_job = self.after(
-                5000, self.poll_messages
-            )  # Poll every 5 seconds
+        self.polling_job = None
+        if not (self.is_polling and self.current_group_id):
+            return
+        if not self.window_visible:
+            return  # Resumed from on_window_map
+        # Skip this round if the previous poll has not come back yet
+        if self.poll_request is None or self.poll_request.done:
+            # Only ask for messages newer than the newest one we have
+            self.poll_request = self.fetch_messages(
+                self.current_group_id,
+                since_id=self.history_index.newest_id(),
+                conditional=True,
+            )
+        self.schedule_poll()
+
+    def poll_likes(self):
+        # Likes do not show up in since_id deltas, so refresh the latest page
+        # on a slower schedule and let reconciliation patch the likes lines
+        self.likes_job = None
+        if not (self.is_polling and self.current_group_id):
+            return
+        if not self.window_visible:
+            return  # Resumed from on_window_map
+        self.fetch_messages(self.current_group_id, conditional=True)
+        self.likes_job = self.after(LIKES_POLL_INTERVAL * 1000, self.poll_likes)
+
+    def on_window_unmap(self, event):
+        if event.widget is self.master:
+            self.window_visible = False  # Minimized: let the poll timers lapse
+            self.animation_ticker.view_changed()
+
+    def on_window_map(self, event):
+        if event.widget is not self.master or self.window_visible:
+            return
+        self.window_visible = True
+        self.animation_ticker.view_changed()
+        if self.is_polling:
+            # Catch up right away, then carry on with the regular schedule
+            self.poll_interval.reset()
+            self.poll_messages()
+            if self.likes_job is None:
+                self.poll_likes()
 
     def validate_readonly_entry(self, new_value):
         # Always return False to prevent any changes to the entry widget
@@ -486,198 +3019,814 @@ class HexChatUI(tk.Frame):
         self.channel_description_entry.config(validate="all")
 
     def update_user_list(self, members):
-        self.user_list.delete(0, tk.END)
-        for member in members:
-            self.user_list.insert(tk.END, member["nickname"])
+        self.member_list.show(self.current_group_id, members)
+
+    def fetch_messages(
+        self, group_id, initial_load=False, since_id=None, conditional=False
+    ):
+        # Polls are conditional: if nothing changed since the last identical
+        # request the backend answers 304 and there is nothing to parse or diff
+        started = time.perf_counter()
+
+        def on_response(messages):
+            self.on_messages(group_id, messages, initial_load, since_id)
+            # Request to rendered, including time queued behind the Tk loop
+            METRICS.record("fetch_messages", time.perf_counter() - started)
+
+        def on_not_modified():
+            if since_id and group_id == self.current_group_id:
+                self.poll_interval.record(False)
+            METRICS.record("fetch_messages 304", time.perf_counter() - started)
+
+        return self.backend.get(
+            f"/groups/{group_id}/messages",
+            callback=on_response,
+            errback=lambda e: self.add_message(
+                "System", f"Error fetching messages: {e}"
+            ),
+            tag="channel",
+            conditional=conditional,
+            not_modified=on_not_modified,
+            params={"since_id": since_id} if since_id else None,
+        )
+
+    @METRICS.timed("on_messages")
+    def on_messages(self, group_id, messages, initial_load=False, since_id=None):
+        if group_id != self.current_group_id:
+            return  # Stale response for a channel we already left
+
+        self.message_store.save(messages)
+        self.message_store.advance_cursor(group_id, messages, since_id)
+        self.confirm_echoes(messages)
+        if initial_load:
+            # From here on history_index holds the channel's tail without gaps
+            self.channel_synced = True
+            self.schedule_prefetch()
+            if self.pending_search_jump:
+                self.after_idle(self.complete_pending_search_jump)
+
+        if since_id:
+            # A delta on top of the history painted from disk. A full page
+            # means there may be a gap after our cached tail, so start over.
+            with self.chat_transaction(follow=initial_load):
+                if len(messages) >= MESSAGE_PAGE_SIZE:
+                    self.clear_chat_history()
+                    self.reset_older_history()
+                self.reconcile_messages(messages)
+            self.poll_interval.record(bool(messages))
+            return
 
-    def fetch_messages(self, group_id, initial_load=False):
+        # Only the ids and likes matter for spotting a change, so keep just
+        # those rather than the whole page
+        page = [(m.get("id"), tuple(m.get("favorited_by") or ())) for m in messages]
+        if page != self.last_page:
+            self.last_page = page
+
+            # Patching in place keeps the view where it was, so only
+            # follow the conversation if the user was already at the end
+            with self.chat_transaction(follow=initial_load):
+                self.reconcile_messages(messages)
+
+    @contextmanager
+    def chat_transaction(self, follow=False, keep_view=False):
+        # Groups chat_history updates so the widget is unlocked once and the
+        # scroll decision is made once, however many changes happen inside.
+        # Nested transactions just join the outermost one.
+        if self.in_chat_transaction:
+            yield
+            return
+        is_at_bottom = not keep_view and self.chat_history.yview()[1] > 0.9
+        self.in_chat_transaction = True
+        self.chat_history.config(state=tk.NORMAL)
         try:
-            response = requests.get(f"http://127.0.0.1:3000/groups/{group_id}/messages")
-            response.raise_for_status()
-            messages = response.json()
+            yield
+        finally:
+            self.chat_history.config(state=tk.DISABLED)
+            self.in_chat_transaction = False
+            # Auto-scroll only if the user was at the bottom
+            if follow or is_at_bottom:
+                self.chat_history.see(tk.END)
 
-            if messages != self.messages_cache:
-                self.messages_cache = messages  # Update cache
+    def reconcile_messages(self, messages):
+        # Only touch what changed: rewrite the likes line of messages whose
+        # favorited_by differs and render messages we have not seen yet.
+        new_messages, changed_likes = self.history_index.diff(messages)
+        for message in changed_likes:
+            self.update_likes(message)
+        for message in new_messages:
+            self.add_new_message(message)
 
-                # Preserve scroll position and check if user is at the bottom
-                scroll_position = self.chat_history.yview()
-                is_at_bottom = scroll_position[1] > 0.9
+    def clear_chat_history(self):
+        self.clear_rendered_messages()
+        self.history_index.clear()
 
-                # Rebuild chat history
-                self.chat_history.config(state=tk.NORMAL)
-                self.chat_history.delete(1.0, tk.END)
-                self.chat_history_image_references.clear()
+    def clear_rendered_messages(self):
+        with self.chat_transaction():
+            self.chat_history.delete(1.0, tk.END)
+            self.forget_pending_lines()
+            # The open channel's unsent messages go back at the bottom
+            for entry in self.outbox.pending(self.current_group_id):
+                self.write_pending_line(entry)
+        self.forget_rendered_messages(self.history_index.rendered_ids())
 
-                for message in reversed(messages):
-                    self.add_new_message(message, from_history=True)
+    def forget_rendered_messages(self, message_ids):
+        # Release everything tied to messages that left chat_history. Their
+        # images stay in the loader's cache, so coming back to them is cheap.
+        marks = list(self.history_index.marks_for(message_ids))
+        for message_id in message_ids:
+            self.chat_history_image_references.pop(message_id, None)
+            self.animation_ticker.remove(message_id)
+            self.link_index.pop(message_id, None)
+            mark = self.image_marks.pop(message_id, None)
+            if mark:
+                marks.append(mark)  # Still loading; dropped on arrival
+        if marks:
+            self.chat_history.mark_unset(*marks)
 
-                self.chat_history.config(state=tk.DISABLED)
+    @METRICS.timed("add_new_message")
+    def add_new_message(self, message):
+        # Returns True if the message is new, False if we already had it
+        message = MessageRecord.of(message)
+        if message.id in self.history_index:
+            return False  # Don't add duplicate messages
 
-                # Restore scroll position or scroll to bottom
-                if initial_load or is_at_bottom:
-                    self.chat_history.see(tk.END)
-                else:
-                    self.chat_history.yview_moveto(scroll_position[0])
+        rendered, next_id = self.history_index.add(message)
+        if rendered:
+            self.render_message(message, next_id)
+        return True
 
-        except requests.exceptions.RequestException as e:
-            self.add_message("System", f"Error fetching messages: {e}")
+    def render_message(self, message, next_id=None):
+        # Render in front of the next newer message, or at the end
+        message_id = message.id
+        if next_id is None and self.pending_lines:
+            # Unsent messages stay below everything that has been sent
+            index = anchor = self.pending_marks(next(iter(self.pending_lines)))[0]
+        elif next_id is None:
+            index = tk.END
+            anchor = "end-1c"
+        else:
+            index = anchor = self.history_index.start_mark(next_id)
+        start = self.chat_history.index(anchor)
 
-    def add_new_message(self, message, from_history=False):
-        message_id = message.get("id")
-        if not from_history and message_id in self.displayed_message_ids:
-            return  # Don't add duplicate real-time messages
+        image_url = message.image_url
+        created_at = datetime.fromtimestamp(message.created_at)
 
-        user = message.get("name", "Unknown")
-        text = message.get("text", "")
-        created_at = datetime.fromtimestamp(message.get("created_at", 0))
+        # Build the whole message up front and insert it in one call; the
+        # image, if any, goes in between the header and the likes line
+        segments, links = self.build_message_segments(
+            message.name, "" if image_url else message.text, created_at
+        )
+        # Offsets into the widget are in Text index characters, which are
+        # not len() for emoji
+        header_length = sum(tk_length(chars) for chars, _ in segments)
+        # Timestamp and name come first; the text starts after them
+        text_offset = tk_length(segments[0][0]) + tk_length(segments[1][0])
+        likes_message = self.format_likes(message.favorited_by)
+        if likes_message:
+            segments.append((likes_message, ("like_message",)))
 
-        # Check for image attachments
-        image_url = None
-        attachments = message.get("attachments", [])
-        for attachment in attachments:
-            if attachment.get("type") == "image":
-                image_url = attachment.get("url")
-                break
+        with self.chat_transaction():
+            self.insert_segments(index, segments)
+            if image_url:
+                self.add_image_to_chat(
+                    image_url,
+                    index=f"{start} + {header_length} chars",
+                    message_id=message_id,
+                )
+
+            # Mark where the message starts and where its likes line lives, so
+            # later refreshes can find them without re-rendering anything
+            start_mark = self.history_index.start_mark(message_id)
+            likes_start, likes_end = self.history_index.likes_marks(message_id)
+            self.chat_history.mark_set(start_mark, start)
+            self.chat_history.mark_set(
+                likes_start, f"{anchor} - {tk_length(likes_message)} chars"
+            )
+            self.chat_history.mark_gravity(likes_start, tk.LEFT)
+            self.chat_history.mark_set(likes_end, anchor)
+            self.chat_history.mark_gravity(likes_end, tk.LEFT)
+            if not image_url:
+                text = message.text
+                for span_start, span_end in self.highlighter.spans(message):
+                    span_start = text_offset + tk_length(text[:span_start])
+                    span_end = text_offset + tk_length(text[:span_end])
+                    self.chat_history.tag_add(
+                        "highlight",
+                        f"{start} + {span_start} chars",
+                        f"{start} + {span_end} chars",
+                    )
+        if links:
+            self.link_index[message_id] = links
 
-        if image_url:
-            self.add_message(user, "", created_at)
-            self.add_image_to_chat(image_url)
-        elif text:
-            self.add_message(user, text, created_at)
-
-        # Display likes
-        favorited_by = message.get("favorited_by", [])
-        if favorited_by:
-            liker_names = [self.get_user_name(liker_id) for liker_id in favorited_by]
-            likes_message = f"  Liked by: {', '.join(liker_names)}"
-            self.add_message("System", likes_message, None, is_like=True)
-
-        self.displayed_message_ids.add(message_id)  # Mark message as displayed
-
-        if not from_history:
-            # Check for mention and play the appropriate sound
-            if f"@{self.current_nickname_in_group}" in text:
-                self.play_mention_sound()
+    def on_chat_scroll(self, first, last):
+        # yscrollcommand: called by the Text widget whenever its view changes
+        if self.window_update_job is None:
+            self.window_update_job = self.after_idle(self.update_history_window)
+        self.animation_ticker.view_changed()
+
+    def update_history_window(self):
+        # Slide the materialized window along the history as the user scrolls
+        # so chat_history only ever holds messages near the viewport
+        self.window_update_job = None
+        index = self.history_index
+        first, last = self.chat_history.yview()
+        if first < HISTORY_WINDOW_EDGE and index.lo > 0:
+            with self.preserve_scroll_anchor():
+                message_ids, next_id = index.extend_up(HISTORY_WINDOW_CHUNK)
+                with self.chat_transaction(keep_view=True):
+                    for message_id in message_ids:
+                        self.render_message(index.get(message_id), next_id)
+                self.trim_history_window(from_top=False)
+        elif last > 1 - HISTORY_WINDOW_EDGE and not index.at_tail():
+            with self.preserve_scroll_anchor():
+                message_ids = index.extend_down(HISTORY_WINDOW_CHUNK)
+                with self.chat_transaction(keep_view=True):
+                    for message_id in message_ids:
+                        self.render_message(index.get(message_id))
+                self.trim_history_window(from_top=True)
+        elif first < HISTORY_WINDOW_EDGE and len(index):
+            # At the top of everything we know: page in older history
+            self.load_older_messages()
+        elif index.rendered_count() > HISTORY_WINDOW_SIZE:
+            # Grown past the budget from new messages: drop the far side
+            with self.preserve_scroll_anchor():
+                self.trim_history_window(from_top=last > 0.5)
+
+    def trim_history_window(self, from_top):
+        index = self.history_index
+        overflow = index.rendered_count() - HISTORY_WINDOW_SIZE
+        if overflow <= 0:
+            return
+        with self.chat_transaction(keep_view=True):
+            if from_top:
+                message_ids = index.shrink_top(overflow)
+                end = index.start_mark(index.order[index.lo][1])
+                self.chat_history.delete(1.0, end)
             else:
-                self.play_new_message_sound()
+                message_ids = index.shrink_bottom(overflow)
+                # Unsent messages below the history stay where they are
+                end = tk.END
+                if self.pending_lines:
+                    end = self.pending_marks(next(iter(self.pending_lines)))[0]
+                self.chat_history.delete(index.start_mark(message_ids[0]), end)
+        self.forget_rendered_messages(message_ids)
 
-    def get_user_name(self, user_id):
-        for member in self.current_members:
-            if member["user_id"] == user_id:
-                return member["nickname"]
-        return "Unknown User"
+    def reset_older_history(self):
+        # Paging state for scroll-back in the open channel. One page is kept
+        # prefetched so it is usually ready before the user reaches the top.
+        self.older_history = {
+            "request": None,  # In-flight BackendRequest for the next page
+            "messages": None,  # Prefetched page waiting to be shown
+            "wanted": False,  # The user is waiting on the in-flight page
+            "exhausted": False,  # Reached the start of the channel
+        }
 
-    def add_image_to_chat(self, image_url, max_size=(300, 300)):
+    def load_older_messages(self):
+        state = self.older_history
+        if state["messages"] is not None:
+            messages, state["messages"] = state["messages"], None
+            self.prepend_older_messages(messages)
+            self.prefetch_older_messages()
+        elif not state["exhausted"]:
+            state["wanted"] = True
+            self.prefetch_older_messages()
+
+    def prefetch_older_messages(self):
+        state = self.older_history
+        if (
+            state["exhausted"]
+            or state["request"] is not None
+            or state["messages"] is not None
+        ):
+            return
+        group_id = self.current_group_id
+        oldest_id = self.history_index.oldest_id()
+        if not group_id or not oldest_id:
+            return
+        state["request"] = self.backend.get(
+            f"/groups/{group_id}/messages",
+            callback=lambda messages: self.on_older_messages(state, messages),
+            errback=lambda e: self.on_older_messages_failed(state, e),
+            tag="channel",
+            params={"before_id": oldest_id, "limit": HISTORY_PAGE_SIZE},
+        )
+
+    def on_older_messages(self, state, messages):
+        if state is not self.older_history:
+            return  # The history this page belonged to has been reset
+        state["request"] = None
+        self.message_store.save(messages)
+        if len(messages) < HISTORY_PAGE_SIZE:
+            state["exhausted"] = True
+        if state["wanted"]:
+            state["wanted"] = False
+            self.prepend_older_messages(messages)
+            self.prefetch_older_messages()  # Get the next page ready
+        else:
+            state["messages"] = messages
+
+    def on_older_messages_failed(self, state, error):
+        if state is not self.older_history:
+            return
+        state["request"] = None
+        state["wanted"] = False
+        print(f"Error fetching older messages: {error}")
+
+    def prepend_older_messages(self, messages):
+        # Older messages go in above what the user is reading without moving it
+        with self.preserve_scroll_anchor():
+            with self.chat_transaction(keep_view=True):
+                for message in sorted(
+                    map(MessageRecord.of, messages), key=lambda m: m.key
+                ):
+                    self.add_new_message(message)
+            self.trim_history_window(from_top=False)
+
+    @contextmanager
+    def preserve_scroll_anchor(self):
+        # Keep the line at the top of the view in place while messages are
+        # added or removed around it
+        self.chat_history.mark_set("view-anchor", "@0,0")
         try:
-            response = requests.get(image_url, stream=True)
-            response.raise_for_status()
-            image_data = response.content
-            image = Image.open(io.BytesIO(image_data))
-            image.thumbnail(max_size, Image.Resampling.LANCZOS)
+            yield
+        finally:
+            self.chat_history.yview("view-anchor")
+            self.chat_history.mark_unset("view-anchor")
 
-            # Ensure image is in RGBA mode for PhotoImage compatibility
-            image = image.convert("RGBA")
+    def jump_to_message(self, message_id):
+        if message_id not in self.history_index:
+            return False
+        if not self.history_index.is_rendered(message_id):
+            # Re-materialize the window around the target message
+            self.clear_rendered_messages()
+            message_ids = self.history_index.recenter(message_id, HISTORY_WINDOW_CHUNK)
+            with self.chat_transaction(keep_view=True):
+                for other_id in message_ids:
+                    self.render_message(self.history_index.get(other_id))
+        self.chat_history.yview(self.history_index.start_mark(message_id))
+        return True
 
-            # Explicitly load the image data to ensure it's fully processed
-            image.load()
+    def open_search_panel(self, event=None):
+        if self.search_panel is not None:
+            self.search_panel.lift()
+            self.search_entry.focus_set()
+            return
 
-            photo = ImageTk.PhotoImage(image)
+        panel = self.search_panel = tk.Toplevel(self.master, bg="#1e1e1e")
+        panel.title("Search messages")
+        panel.geometry("640x400")
+        panel.bind("<Destroy>", self.on_search_panel_destroy)
 
-            self.chat_history.config(state=tk.NORMAL)
-            self.chat_history.image_create(tk.END, image=photo)
-            self.chat_history.insert(tk.END, "\n")  # Add a newline after the image
-            self.chat_history.config(state=tk.DISABLED)
+        controls = tk.Frame(panel, bg="#1e1e1e")
+        controls.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.search_entry = tk.Entry(
+            controls,
+            bg="#3c3c3c",
+            fg="white",
+            insertbackground="white",
+            borderwidth=0,
+            font=("Courier", 12),
+        )
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.search_entry.bind("<Return>", self.run_search)
+        self.search_entry.bind("<Escape>", lambda event: panel.destroy())
+        self.search_all_channels = tk.BooleanVar(panel, value=False)
+        tk.Checkbutton(
+            controls,
+            text="All channels",
+            variable=self.search_all_channels,
+            command=self.run_search,
+            bg="#1e1e1e",
+            fg="white",
+            selectcolor="#2a2a2a",
+            activebackground="#1e1e1e",
+        ).pack(side=tk.LEFT, padx=5)
 
-            # Auto-scroll only if the user is near the bottom
-            scroll_position = self.chat_history.yview()[1]
-            if scroll_position > 0.9:
-                self.chat_history.see(tk.END)
+        self.search_status = tk.Label(panel, bg="#1e1e1e", fg="#a9a9a9", anchor=tk.W)
+        self.search_status.pack(side=tk.TOP, fill=tk.X, padx=5)
+        self.search_result_list = tk.Listbox(
+            panel,
+            bg="#3c3c3c",
+            fg="white",
+            selectbackground="#555555",
+            selectforeground="white",
+            highlightthickness=0,
+            borderwidth=0,
+            font=("Courier", 11),
+        )
+        self.search_result_list.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.search_result_list.bind("<<ListboxSelect>>", self.on_search_result_select)
+        self.search_entry.focus_set()
 
-            self.chat_history_image_references.append(photo)  # Keep a reference
-        except Exception as e:
-            self.add_message("System", f"Error loading image from {image_url}: {e}")
+    def on_search_panel_destroy(self, event):
+        if event.widget is not self.search_panel:
+            return  # A child widget going away with the panel
+        self.search_panel = None
+        self.search_results = []
+        self.search_terms = []
+        self.pending_search_jump = None
+        self.chat_history.tag_remove("search_hit", 1.0, tk.END)
+        self.chat_history.tag_remove("search_match", 1.0, tk.END)
+        self.leave_search_context()
 
-    def send_message(self, event):
-        message_text = self.chat_input.get()
-        if message_text and self.current_group_id:
-            try:
-                payload = {"text": message_text}
-                response = requests.post(
-                    f"http://127.0.0.1:3000/groups/{self.current_group_id}/messages",
-                    json=payload,
+    def run_search(self, event=None):
+        query = self.search_entry.get()
+        group_id = None if self.search_all_channels.get() else self.current_group_id
+        start = time.perf_counter()
+        self.search_results = self.message_store.search(query, group_id)
+        elapsed = time.perf_counter() - start
+        METRICS.record("search", elapsed)
+        self.search_terms = MessageStore.search_terms(query)
+
+        self.search_result_list.delete(0, tk.END)
+        for message in self.search_results:
+            group = self.roster.get(message.get("group_id")) or {}
+            timestamp = datetime.fromtimestamp(message.get("created_at", 0))
+            text = " ".join((message.get("text") or "").split())
+            self.search_result_list.insert(
+                tk.END,
+                f"#{group.get('name', '?')} [{timestamp:%Y-%m-%d %H:%M}] "
+                f"{message.get('name', 'Unknown')}: {text[:120]}",
+            )
+        self.search_status.config(
+            text=f"{len(self.search_results)} results in {elapsed * 1000:.1f} ms"
+        )
+
+    def on_search_result_select(self, event):
+        selection = self.search_result_list.curselection()
+        if not selection:
+            return
+        message = self.search_results[selection[0]]
+        group_id = message.get("group_id")
+        if group_id == self.current_group_id:
+            self.jump_to_search_result(message)
+            return
+        # Open the result's channel first; the jump completes once it loads
+        self.pending_search_jump = message
+        if not self.select_channel(group_id):
+            self.pending_search_jump = None
+            self.search_status.config(text="That channel is no longer in your list")
+
+    def complete_pending_search_jump(self):
+        message, self.pending_search_jump = self.pending_search_jump, None
+        if message and message.get("group_id") == self.current_group_id:
+            self.jump_to_search_result(message)
+
+    def jump_to_search_result(self, message):
+        message_id = message.get("id")
+        if message_id not in self.history_index:
+            # Older than anything loaded: bring in its surroundings from disk
+            context = self.message_store.around(
+                self.current_group_id,
+                message_id,
+                before=HISTORY_WINDOW_CHUNK,
+                after=HISTORY_WINDOW_CHUNK,
+            )
+            self.show_search_context(context or [message])
+        if not self.jump_to_message(message_id):
+            return
+        self.chat_history.tag_remove("search_hit", 1.0, tk.END)
+        start_mark = self.history_index.start_mark(message_id)
+        likes_start, _ = self.history_index.likes_marks(message_id)
+        self.chat_history.tag_add("search_hit", start_mark, likes_start)
+        self.highlight_search_terms()
+
+    def show_search_context(self, messages):
+        # The surroundings of an old hit do not connect to the tail, so they
+        # replace it rather than join it: history_index only ever holds one
+        # contiguous run. Scrolling back pages in older history as usual;
+        # the tail comes back with leave_search_context.
+        if self.channel_synced:
+            # Keep the tail warm in memory for the way back
+            self.channel_buffers.seed(
+                self.current_group_id,
+                self.history_index.tail(CHANNEL_BUFFER_SIZE),
+            )
+        self.stop_polling()
+        self.backend.cancel("channel")
+        self.channel_synced = False
+        self.search_context = True
+        self.clear_chat_history()
+        self.last_page = None
+        self.reset_older_history()
+        with self.chat_transaction(keep_view=True):
+            self.reconcile_messages(messages)
+
+    def leave_search_context(self):
+        # Back from a search hit to the channel's latest messages
+        if not self.search_context:
+            return
+        self.search_context = False
+        group = self.roster.get(self.current_group_id)
+        self.clear_chat_history()
+        self.reset_older_history()
+        if group:
+            warm = self.paint_cached_channel(group["id"])
+            self.show_channel(group, fetch=not warm)
+
+    def highlight_search_terms(self):
+        # Mark every word starting with a search term in the rendered window
+        self.chat_history.tag_remove("search_match", 1.0, tk.END)
+        length = tk.IntVar(self)
+        for term in self.search_terms:
+            index = "1.0"
+            while True:
+                index = self.chat_history.search(
+                    rf"\m{term}",
+                    index,
+                    stopindex=tk.END,
+                    regexp=True,
+                    nocase=True,
+                    count=length,
                 )
-                response.raise_for_status()
-                self.chat_input.delete(0, tk.END)
-                # Display sent message immediately
-                # self.add_message(nickname, message_text) # Display sent message immediately
-                # self.fetch_messages(self.current_group_id) # No need to re-fetch all messages
-            except requests.exceptions.RequestException as e:
-                self.add_message("System", f"Error sending message: {e}")
-
-    def add_message(self, user, message, timestamp=None, is_like=False):
-        self.chat_history.config(state=tk.NORMAL)
+                if not index or not length.get():
+                    break
+                end = f"{index} + {length.get()} chars"
+                self.chat_history.tag_add("search_match", index, end)
+                index = end
 
-        if is_like:
-            self.chat_history.tag_configure(
-                "like_message", foreground="#ff69b4"
-            )  # Pink for likes
-            self.chat_history.insert(tk.END, f"{message}\n", "like_message")
-        else:
-            # User tag
-            user_font = font.Font(self.chat_history, self.chat_history.cget("font"))
-            user_font.configure(weight="bold")
-            self.chat_history.tag_configure(
-                "user_tag", font=user_font, foreground="#87ceeb"
+    def notify_new_messages(self, messages, highlight_elsewhere=False):
+        # One sound per batch, and a highlight (here or in another unmuted
+        # channel) wins over an ordinary ping
+        muted = self.current_group_id in self.muted_channels
+        if highlight_elsewhere or (
+            not muted and any(self.highlighter.matches(m) for m in messages)
+        ):
+            self.play_mention_sound()
+        elif messages and not muted:
+            self.play_new_message_sound()
+
+    def update_likes(self, message):
+        message_id = message.id
+        favorited_by = message.favorited_by
+        self.history_index.update(message)
+        if not self.history_index.is_rendered(message_id):
+            return  # Picked up from the index when it is materialized
+        likes_start, likes_end = self.history_index.likes_marks(message_id)
+        with self.chat_transaction():
+            self.chat_history.delete(likes_start, likes_end)
+            self.render_likes(message_id, favorited_by)
+
+    def format_likes(self, favorited_by):
+        if not favorited_by:
+            return ""
+        liker_names = [self.get_user_name(liker_id) for liker_id in favorited_by]
+        return f"  Liked by: {', '.join(liker_names)}\n"
+
+    def render_likes(self, message_id, favorited_by):
+        likes_message = self.format_likes(favorited_by)
+        if not likes_message:
+            return
+        likes_start, likes_end = self.history_index.likes_marks(message_id)
+        # Both marks rest with left gravity; the end mark briefly takes right
+        # gravity so the insert carries it past the new text
+        self.chat_history.mark_gravity(likes_end, tk.RIGHT)
+        with self.chat_transaction():
+            self.chat_history.insert(likes_start, likes_message, "like_message")
+        self.chat_history.mark_gravity(likes_end, tk.LEFT)
+
+    def get_user_name(self, user_id):
+        return self.roster.nickname(self.current_group_id, user_id)
+
+    @METRICS.timed("add_image_to_chat")
+    def add_image_to_chat(
+        self, image_url, max_size=(300, 300), index=tk.END, message_id=None
+    ):
+        photo = self.image_loader.cached(image_url, max_size)
+        if photo is not None:
+            self.insert_chat_image(photo, index, message_id)
+            return
+
+        # Show a placeholder right away and swap the image in once it arrives
+        mark = f"image-{message_id}"
+        anchor = "end-1c" if index == tk.END else index
+        with self.chat_transaction():
+            self.chat_history.mark_set(mark, anchor)
+            self.chat_history.mark_gravity(mark, tk.LEFT)
+            self.chat_history.insert(
+                index, IMAGE_PLACEHOLDER + "\n", "image_placeholder"
             )
+        self.image_marks[message_id] = mark
+
+        self.image_loader.load(
+            image_url,
+            max_size,
+            lambda photo, error: self.on_image_loaded(
+                message_id, image_url, photo, error
+            ),
+        )
+
+    def on_image_loaded(self, message_id, image_url, photo, error):
+        mark = self.image_marks.pop(message_id, None)
+        if mark is None:
+            return  # The message left chat_history while the image was loading
 
-            # Timestamp
-            if timestamp is None:
-                timestamp = datetime.now()
-            timestamp_str = timestamp.strftime("%H:%M")
-            self.chat_history.tag_configure("timestamp", foreground="#a9a9a9")
-
-            self.chat_history.insert(tk.END, f"[{timestamp_str}] ", "timestamp")
-            self.chat_history.insert(tk.END, f"{user}: ", "user_tag")
-
-            # Find and tag hyperlinks
-            url_pattern = re.compile(r"https?://\S+")
-            matches = url_pattern.finditer(message)
-            last_end = 0
-            for match in matches:
-                start, end = match.span()
-                self.chat_history.insert(tk.END, message[last_end:start])
-                # Insert the hyperlink with a tag
-                hyperlink = message[start:end]
+        with self.chat_transaction():
+            self.chat_history.delete(mark, f"{mark} + {len(IMAGE_PLACEHOLDER)} chars")
+            if photo is not None:
+                self.embed_image(mark, photo, message_id)
+            else:
                 self.chat_history.insert(
-                    tk.END, hyperlink, ("hyperlink", f"hyperlink-{hyperlink}")
+                    mark, f"Error loading image from {image_url}: {error}", "timestamp"
                 )
-                last_end = end
-            self.chat_history.insert(tk.END, message[last_end:] + "\n")
+        self.chat_history.mark_unset(mark)
+        if photo is not None:
+            self.enforce_memory_budget()
 
-            self.chat_history.tag_configure(
-                "hyperlink", foreground="#00BFFF", underline=True
-            )
-            self.chat_history.tag_bind(
-                "hyperlink", "<Button-1>", self.on_hyperlink_click
+    def insert_chat_image(self, photo, index, message_id=None):
+        # Resolve the index first so the newline lands after the image however
+        # index was given (end, a mark or an offset expression)
+        position = self.chat_history.index(index)
+        with self.chat_transaction():
+            self.embed_image(position, photo, message_id)
+            # Add a newline after the image
+            self.chat_history.insert(f"{position} + 1c", "\n")
+
+    def embed_image(self, index, photo, message_id):
+        # An animation gets a display image of its own that the ticker copies
+        # frames into, so the cached frames stay shared between messages
+        if isinstance(photo, Animation):
+            animation = photo
+            photo = tk.PhotoImage(
+                master=self.chat_history,
+                width=animation.width(),
+                height=animation.height(),
             )
-            self.chat_history.tag_bind("hyperlink", "<Enter>", self.on_hyperlink_enter)
-            self.chat_history.tag_bind("hyperlink", "<Leave>", self.on_hyperlink_leave)
+            photo.tk.call(photo, "copy", animation.frames[0])
+            name = self.chat_history.image_create(index, image=photo)
+            self.animation_ticker.add(message_id, animation, photo, name)
+        else:
+            self.chat_history.image_create(index, image=photo)
+        self.chat_history_image_references[message_id] = photo  # Keep a reference
+
+    def send_message(self, event):
+        # Shown right away as pending; the outbox sends it in the background
+        # and it turns into the real message when the echo or the response
+        # comes back
+        message_text = self.chat_input.get()
+        if message_text and self.current_group_id:
+            self.leave_search_context()  # Replies belong with the latest messages
+            self.chat_input.delete(0, tk.END)
+            entry = self.outbox.add(self.current_group_id, message_text)
+            with self.chat_transaction(follow=True):
+                self.write_pending_line(entry)
+
+    def on_outbox_change(self, entry):
+        if entry.group_id == self.current_group_id:
+            with self.chat_transaction():
+                self.write_pending_line(entry)
+
+    def on_outbox_sent(self, entry, message):
+        self.message_store.save([message])
+        if entry.group_id == self.current_group_id:
+            with self.chat_transaction():
+                self.remove_pending_line(entry.guid)
+                if not self.search_context:
+                    self.add_new_message(message)
+
+    def confirm_echoes(self, messages):
+        if not len(self.outbox):
+            return
+        for message in messages:
+            entry = self.outbox.confirm(message.get("source_guid"))
+            if entry is not None and entry.guid in self.pending_lines:
+                with self.chat_transaction():
+                    self.remove_pending_line(entry.guid)
+
+    def pending_marks(self, guid):
+        return f"pending-{guid}", f"pending-end-{guid}"
+
+    def write_pending_line(self, entry):
+        # Writes or rewrites the line of an unsent message. Pending lines sit
+        # at the end of chat_history in the order they were typed; the start
+        # mark keeps right gravity so sent messages rendered in front of it
+        # push it along. The marks are set around the insert by gravity, as
+        # Tk's character count differs from len() for emoji.
+        start, end = self.pending_marks(entry.guid)
+        if entry.guid in self.pending_lines:
+            position = self.chat_history.index(start)
+            self.chat_history.delete(start, end)
+        else:
+            position = self.chat_history.index("end-1c")
+            self.pending_lines[entry.guid] = True
+        tags = ("pending",)
+        if entry.status == "retrying":
+            status = f" (retrying in {entry.retry_in:.0f}s)"
+        elif entry.status == "failed":
+            status = " (not sent, click to retry)"
+            tags = ("unsent", "pending")
+        else:
+            status = " (sending...)"
+        segments, _ = self.build_message_segments(
+            self.current_nickname_in_group or self.current_username,
+            entry.text,
+        )
+        segments[-1] = (segments[-1][0].rstrip("\n"), segments[-1][1])
+        segments.append((f"{status}\n", ("timestamp",)))
+        segments = [(chars, segment_tags + tags) for chars, segment_tags in segments]
+        self.chat_history.mark_set(start, position)
+        self.chat_history.mark_gravity(start, tk.LEFT)
+        self.chat_history.mark_set(end, position)
+        self.chat_history.mark_gravity(end, tk.RIGHT)
+        self.insert_segments(position, segments)
+        self.chat_history.mark_gravity(start, tk.RIGHT)
+        self.chat_history.mark_gravity(end, tk.LEFT)
 
-        self.chat_history.config(state=tk.DISABLED)
+    def remove_pending_line(self, guid):
+        if self.pending_lines.pop(guid, None) is None:
+            return
+        start, end = self.pending_marks(guid)
+        self.chat_history.delete(start, end)
+        self.chat_history.mark_unset(start, end)
 
-        # Auto-scroll only if the user is near the bottom
-        scroll_position = self.chat_history.yview()[1]
-        if scroll_position > 0.9:
-            self.chat_history.see(tk.END)
+    def on_unsent_click(self, event):
+        for guid in self.pending_lines:
+            start, end = self.pending_marks(guid)
+            if self.chat_history.compare(
+                start, "<=", tk.CURRENT
+            ) and self.chat_history.compare(tk.CURRENT, "<", end):
+                self.outbox.retry(guid)
+                return
+
+    def forget_pending_lines(self):
+        for guid in self.pending_lines:
+            self.chat_history.mark_unset(*self.pending_marks(guid))
+        self.pending_lines.clear()
+
+    def add_message(self, user, message, timestamp=None):
+        segments, _ = self.build_message_segments(user, message, timestamp)
+        with self.chat_transaction():
+            self.insert_segments(tk.END, segments)
+
+    def build_message_segments(self, user, message, timestamp=None):
+        # Split a message into (text, tags) segments, plus the spans of its
+        # links as (start, end, url) offsets from the message start, counted
+        # in Text index characters
+        if timestamp is None:
+            timestamp = datetime.now()
+        segments = [
+            (f"[{timestamp.strftime('%H:%M')}] ", ("timestamp",)),
+            (f"{user}: ", ("user_tag",)),
+        ]
+        offset = sum(tk_length(chars) for chars, _ in segments)
+        links = []
+        last_end = 0
+        for match in URL_PATTERN.finditer(message):
+            start, end = match.span()
+            if start > last_end:
+                segments.append((message[last_end:start], ()))
+                offset += tk_length(message[last_end:start])
+            url = match.group()
+            segments.append((url, ("hyperlink",)))
+            links.append((offset, offset + tk_length(url), url))
+            offset += tk_length(url)
+            last_end = end
+        segments.append((message[last_end:] + "\n", ()))
+        return segments, links
+
+    def insert_segments(self, index, segments):
+        # Text.insert takes alternating chars/tags arguments, so a whole
+        # message goes in with a single call
+        args = []
+        for chars, tags in segments:
+            args.extend((chars, tags))
+        self.chat_history.insert(index, *args)
 
     def on_hyperlink_click(self, event):
-        # Get the tag at the clicked position
-        tags = self.chat_history.tag_names(tk.CURRENT)
-        for tag in tags:
-            if tag.startswith("hyperlink-"):
-                url = tag.replace("hyperlink-", "", 1)
-                webbrowser.open_new(url)
-                break
+        link_range = self.chat_history.tag_prevrange("hyperlink", f"{tk.CURRENT} + 1c")
+        if not link_range:
+            return
+        start, end = link_range
+        # Links outside the message model (e.g. in system lines) read as their
+        # own text
+        url = self.find_link(start) or self.chat_history.get(start, end)
+        webbrowser.open_new(url)
+
+    def find_link(self, index):
+        message_id = self.message_at(index)
+        if message_id is None:
+            return None
+        count = self.chat_history.count(
+            self.history_index.start_mark(message_id), index, "chars"
+        )
+        offset = (count[0] if isinstance(count, tuple) else count) or 0
+        for start, end, url in self.link_index.get(message_id, ()):
+            if start <= offset < end:
+                return url
+        return None
+
+    def message_at(self, index):
+        # Binary search the rendered window for the message covering index
+        message_ids = self.history_index.rendered_ids()
+        lo, hi = 0, len(message_ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mark = self.history_index.start_mark(message_ids[mid])
+            if self.chat_history.compare(mark, "<=", index):
+                lo = mid + 1
+            else:
+                hi = mid
+        return message_ids[lo - 1] if lo else None
 
     def on_hyperlink_enter(self, event):
         self.chat_history.config(cursor="hand2")
@@ -686,35 +3835,203 @@ class HexChatUI(tk.Frame):
         self.chat_history.config(cursor="")
 
     def play_mention_sound(self):
-        print("play_mention_sound() called.")
-        try:
-            threading.Thread(
-                target=playsound, args=("sounds/mentioned.mp3",), daemon=True
-            ).start()
-        except Exception as e:
-            print(f"Error playing sound: {e}")
+        self.sound_player.play("mention")
 
     def play_new_message_sound(self):
+        self.sound_player.play("ping")
+
+    def load_highlight_rules(self):
+        # {"keywords": [...], "patterns": [...]}: words that highlight like a
+        # mention, and regular expressions for anything fancier
         try:
-            threading.Thread(
-                target=playsound, args=("sounds/ping.mp3",), daemon=True
-            ).start()
-        except Exception as e:
-            print(f"Error playing sound: {e}")
+            with open(os.path.join(CONFIG_DIR, "highlights.json")) as f:
+                rules = json.load(f)
+            return rules.get("keywords") or [], rules.get("patterns") or []
+        except (OSError, ValueError, AttributeError):
+            return [], []
 
-    def process_message_queue(self):
+    def update_highlight_identity(self):
+        # The user's nickname in every group they are in, falling back to
+        # their account name like the rest of the UI does
+        nicknames = {
+            group_id: self.roster.nickname(
+                group_id, self.current_user_id, default=self.current_username
+            )
+            for group_id in self.roster.groups
+        }
+        self.highlighter.set_identity(self.current_user_id, nicknames)
+
+    def load_muted_channels(self):
+        try:
+            with open(os.path.join(CONFIG_DIR, "muted_channels.json")) as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def save_muted_channels(self):
         try:
-            while not self.message_queue.empty():
-                message_data = self.message_queue.get_nowait()
+            os.makedirs(CONFIG_DIR, exist_ok=True)
+            with open(os.path.join(CONFIG_DIR, "muted_channels.json"), "w") as f:
+                json.dump(sorted(self.muted_channels), f)
+        except OSError as e:
+            print(f"Could not save muted channels: {e}")
+
+    def toggle_channel_mute(self, group_id):
+        if group_id in self.muted_channels:
+            self.muted_channels.discard(group_id)
+        else:
+            self.muted_channels.add(group_id)
+        self.save_muted_channels()
+        self.refresh_channel_list()
+
+    def on_channel_context_menu(self, event):
+        index = self.channel_list.nearest(event.y)
+        if not 0 <= index < len(self.channel_rows):
+            return
+        group_id = self.channel_rows.group_at(index)
+        menu = tk.Menu(self.channel_list, tearoff=0)
+        menu.add_command(
+            label="Unmute channel"
+            if group_id in self.muted_channels
+            else "Mute channel",
+            command=lambda: self.toggle_channel_mute(group_id),
+        )
+        menu.tk_popup(event.x_root, event.y_root)
+
+    def notify_message_queue(self):
+        # Called from the push thread. Wakes the Tk loop only when there is
+        # work, and only once until the pending drain has run.
+        if not self.drain_pending.is_set():
+            self.drain_pending.set()
+            self.master.after(0, self.process_message_queue)
+
+    @METRICS.timed("process_message_queue")
+    def process_message_queue(self):
+        self.drain_pending.clear()
+        if METRICS.enabled:
+            METRICS.gauge("push.queue_depth", self.message_queue.qsize())
+        deadline = time.monotonic() + QUEUE_DRAIN_BUDGET
+        received = []
+        rendered = []
+        arrivals = []
+        unread_groups = set()
+        highlight_elsewhere = False
+        # Everything drained in one go is rendered as a single transaction
+        with self.chat_transaction():
+            while not self.message_queue.empty() and time.monotonic() < deadline:
+                received_at, message_data = self.message_queue.get_nowait()
+                arrivals.append(received_at)
                 if message_data.get("type") == "line.create":
                     message = message_data.get("subject")
-                    if message and message.get("group_id") == self.current_group_id:
-                        # Add to message cache
-                        self.messages_cache.append(message)
-                        # Add to UI
-                        self.add_new_message(message)
-        finally:
-            self.after(100, self.process_message_queue)
+                    if message:
+                        received.append(message)
+                        self.on_roster_event(message)
+                        self.confirm_echoes((message,))
+                    if not message or not message.get("group_id"):
+                        continue
+                    # Every group's events feed its buffer, not just ours
+                    record = MessageRecord.of(message)
+                    self.channel_buffers.add(record)
+                    if record.group_id == self.current_group_id:
+                        if self.search_context:
+                            continue  # Comes back with the tail
+                        if self.add_new_message(record):
+                            rendered.append(record)
+                    elif record.sender_id != self.current_user_id:
+                        highlight = self.highlighter.matches(record)
+                        self.channel_buffers.mark_unread(record.group_id, highlight)
+                        unread_groups.add(record.group_id)
+                        if highlight and record.group_id not in self.muted_channels:
+                            highlight_elsewhere = True
+        self.message_store.save(received)  # Any group
+        self.notify_new_messages(rendered, highlight_elsewhere)
+        if received:
+            self.refresh_channel_list()  # Activity and badges moved rows around
+        if any(not self.channel_buffers.is_warm(g) for g in unread_groups):
+            self.schedule_prefetch()  # Activity makes these likelier to be opened
+        if METRICS.enabled:
+            now = time.perf_counter()
+            for received_at in arrivals:
+                METRICS.record("push.to_render", now - received_at)
+        self.enforce_memory_budget()
+
+        if not self.message_queue.empty():
+            # Out of budget: let pending input events run, then continue
+            self.drain_pending.set()
+            self.after(1, self.process_message_queue)
+
+    def enforce_memory_budget(self):
+        # Evicts the least recently viewed images and channel buffers once
+        # the caches together go over budget
+        evicted = self.memory_budget.enforce()
+        if evicted:
+            print(f"Memory budget: evicted {evicted / 2**20:.1f} MiB")
+        if METRICS.enabled:
+            for name, used in self.memory_budget.usage().items():
+                METRICS.gauge(f"memory.{name.replace(' ', '_')}_bytes", used)
+            # Rendered images stay alive through chat_history, cached or not
+            METRICS.gauge(
+                "memory.rendered_images_bytes",
+                sum(
+                    photo.width() * photo.height() * 4
+                    for photo in self.chat_history_image_references.values()
+                ),
+            )
+
+    def schedule_prefetch(self):
+        if self.prefetch_job is None:
+            self.prefetch_job = self.after(PREFETCH_DELAY_MS, self.prefetch_channels)
+
+    def prefetch_channels(self):
+        # Warm up the cold channels the user is most likely to open next.
+        # Without push their buffers would go stale at once, so don't bother.
+        self.prefetch_job = None
+        if not self.channel_buffers.connected:
+            return
+        for group_id in self.channel_buffers.likely_next(
+            self.groups, exclude=self.current_group_id
+        ):
+            if group_id in self.prefetching:
+                continue
+            self.prefetching.add(group_id)
+            self.backend.get(
+                f"/groups/{group_id}/messages",
+                callback=lambda messages, g=group_id: self.on_prefetched(g, messages),
+                errback=lambda e, g=group_id: self.prefetching.discard(g),
+            )
+
+    def on_prefetched(self, group_id, messages):
+        self.prefetching.discard(group_id)
+        self.message_store.save(messages)
+        self.message_store.advance_cursor(group_id, messages)
+        # Push events that raced the request are already in the buffer
+        self.channel_buffers.seed(group_id, [MessageRecord.of(m) for m in messages])
+        self.enforce_memory_budget()
+
+    def on_roster_event(self, message):
+        # Joins, leaves, kicks and renames arrive as system messages whose
+        # event type tells us the cached roster for that group is out of date
+        event_type = (message.get("event") or {}).get("type", "")
+        if event_type.startswith(("membership.", "group.")):
+            group_id = message.get("group_id")
+            self.roster.invalidate(group_id)
+            if group_id == self.current_group_id:
+                # The backend's cached copy predates the event, so skip it
+                self.backend.get(
+                    "/groups",
+                    callback=self.on_roster_refresh,
+                    tag="channel",
+                    headers={"Cache-Control": "no-cache"},
+                )
+
+    def on_roster_refresh(self, groups):
+        self.groups = groups
+        self.roster.update(groups)
+        self.update_highlight_identity()
+        self.update_channel_list()
+        group = self.roster.get(self.current_group_id)
+        if group:
+            self.update_user_list(group["members"])
 
     def start_faye_client(self):
         if self.groupme_push_client and not self.groupme_push_client.running:
@@ -734,6 +4051,113 @@ class HexChatUI(tk.Frame):
             self.online_indicator.find_all()[0], fill=color, outline=color
         )
 
+        # Buffers only stay current while push is up
+        self.channel_buffers.set_connected(status == "connected")
+        if status == "connected":
+            self.schedule_prefetch()
+
+        # Poll more often while push is down, and back off once it is up
+        self.poll_interval.set_push_status(status)
+        if self.is_polling and self.polling_job:
+            self.schedule_poll()
+
+    def schedule_lag_check(self):
+        self.lag_job = self.after(
+            LAG_HEARTBEAT_MS, self.check_event_loop_lag, time.perf_counter()
+        )
+
+    def check_event_loop_lag(self, scheduled_at):
+        # The heartbeat fires late by however long the loop was busy
+        self.lag_job = None
+        lag = time.perf_counter() - scheduled_at - LAG_HEARTBEAT_MS / 1000
+        METRICS.record("tk.lag", max(lag, 0))
+        if lag > LAG_WARNING:
+            print(f"Tk event loop stalled for {lag * 1000:.0f} ms")
+        if METRICS.enabled:
+            self.schedule_lag_check()
+
+    def set_metrics_enabled(self, enabled):
+        METRICS.enabled = enabled
+        if enabled and self.lag_job is None:
+            self.schedule_lag_check()
+
+    def toggle_debug_panel(self, event=None):
+        if self.debug_panel is not None:
+            self.debug_panel.destroy()
+            return
+
+        panel = self.debug_panel = tk.Toplevel(self.master, bg="#1e1e1e")
+        panel.title("GxChat metrics")
+        panel.geometry("760x480")
+        panel.bind("<Destroy>", self.on_debug_panel_destroy)
+
+        controls = tk.Frame(panel, bg="#1e1e1e")
+        controls.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        enabled = tk.BooleanVar(panel, value=METRICS.enabled)
+        tk.Checkbutton(
+            controls,
+            text="Collect metrics",
+            variable=enabled,
+            command=lambda: self.set_metrics_enabled(enabled.get()),
+            bg="#1e1e1e",
+            fg="white",
+            selectcolor="#2a2a2a",
+            activebackground="#1e1e1e",
+        ).pack(side=tk.LEFT)
+        tk.Button(controls, text="Reset", command=METRICS.reset).pack(
+            side=tk.LEFT, padx=5
+        )
+        tk.Button(controls, text="Dump JSON", command=self.dump_metrics).pack(
+            side=tk.LEFT
+        )
+        self.debug_panel_status = tk.Label(
+            controls, bg="#1e1e1e", fg="#a9a9a9", anchor=tk.W
+        )
+        self.debug_panel_status.pack(side=tk.LEFT, fill=tk.X, padx=5)
+
+        self.debug_panel_text = tk.Text(
+            panel,
+            bg="#1e1e1e",
+            fg="white",
+            font=("Courier", 10),
+            borderwidth=0,
+            highlightthickness=0,
+            wrap=tk.NONE,
+        )
+        self.debug_panel_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.refresh_debug_panel()
+
+    def refresh_debug_panel(self):
+        self.debug_panel_job = None
+        if self.debug_panel is None:
+            return
+        self.debug_panel_text.config(state=tk.NORMAL)
+        self.debug_panel_text.delete(1.0, tk.END)
+        self.debug_panel_text.insert(
+            tk.END, self.memory_budget.report() + "\n\n" + METRICS.report()
+        )
+        self.debug_panel_text.config(state=tk.DISABLED)
+        self.debug_panel_job = self.after(1000, self.refresh_debug_panel)
+
+    def on_debug_panel_destroy(self, event):
+        if event.widget is not self.debug_panel:
+            return  # A child widget going away with the panel
+        self.debug_panel = None
+        if self.debug_panel_job:
+            self.after_cancel(self.debug_panel_job)
+            self.debug_panel_job = None
+
+    def dump_metrics(self):
+        path = os.path.join(CACHE_DIR, f"metrics-{int(time.time())}.json")
+        try:
+            METRICS.dump(path)
+        except OSError as e:
+            print(f"Could not write metrics to {path}: {e}")
+            self.debug_panel_status.config(text=f"Dump failed: {e}")
+            return
+        print(f"Metrics written to {path}")
+        self.debug_panel_status.config(text=f"Written to {path}")
+
 
 if __name__ == "__main__":
     root = tk.Tk()
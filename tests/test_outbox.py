@@ -0,0 +1,63 @@
+import main
+
+
+class FakeBackend:
+    def __init__(self):
+        self.posts = []  # (callback, errback, text) per send
+
+    def post(self, path, callback, errback, json):
+        self.posts.append((callback, errback, json["text"]))
+
+
+class FakeWidget:
+    def __init__(self):
+        self.jobs = {}
+        self.cancelled = []
+
+    def after(self, ms, func):
+        job = f"after#{len(self.jobs)}"
+        self.jobs[job] = func
+        return job
+
+    def after_cancel(self, job):
+        self.cancelled.append(job)
+
+
+def make_outbox():
+    backend, widget = FakeBackend(), FakeWidget()
+    outbox = main.Outbox(backend, widget, lambda entry: None, lambda e, m: None)
+    return outbox, backend, widget
+
+
+def test_confirming_a_failed_entry_keeps_another_entrys_backoff(monkeypatch):
+    monkeypatch.setattr(main, "OUTBOX_MAX_ATTEMPTS", 2)
+    outbox, backend, widget = make_outbox()
+    failed = outbox.add("g", "first")
+    backend.posts[-1][1](Exception("down"))  # first -> retrying
+    widget.jobs.popitem()[1]()  # Its retry fires
+    backend.posts[-1][1](Exception("down"))  # first -> failed
+    assert failed.status == "failed"
+
+    waiting = outbox.add("g", "second")
+    assert backend.posts[-1][2] == "second"
+    backend.posts[-1][1](Exception("down"))  # second -> retrying
+    assert waiting.status == "retrying"
+    sends = len(backend.posts)
+
+    # The failed message went through after all and its echo arrives
+    assert outbox.confirm(failed.guid) is failed
+    assert widget.cancelled == []
+    assert outbox.retry_job is not None
+    assert len(backend.posts) == sends  # second still waits out its backoff
+
+
+def test_confirming_the_retrying_entry_cancels_its_retry():
+    outbox, backend, widget = make_outbox()
+    entry = outbox.add("g", "hello")
+    backend.posts[-1][1](Exception("down"))
+    job = outbox.retry_job
+
+    assert outbox.confirm(entry.guid) is entry
+    assert widget.cancelled == [job]
+    assert outbox.retry_job is None
+    assert len(outbox) == 0